@@ -0,0 +1,352 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+SCENARIOS = ("profile", "water", "food", "workout", "progress", "charts", "history")
+
+CITIES = ["Moscow", "London", "Paris", "Berlin", "Madrid", "Rome", "Tokyo", "Dubai", "Cairo", "Oslo"]
+FOODS = ["apple", "banana", "rice", "chicken", "bread", "cheese", "yogurt", "pasta", "salmon", "oat"]
+
+
+class StubApis:
+    def __init__(self, latency: float, error_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.port: Optional[int] = None
+        self.requests: Dict[str, int] = {"weather": 0, "openfoodfacts": 0, "fatsecret": 0}
+
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stub-apis", daemon=True)
+
+    async def _delay(self, api: str) -> bool:
+        self.requests[api] += 1
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        return random.random() >= self.error_rate
+
+    async def weather(self, request: web.Request) -> web.Response:
+        if not await self._delay("weather"):
+            return web.json_response({"message": "stub error"}, status=503)
+        city = request.query.get("q", "")
+        return web.json_response({"main": {"temp": 10 + sum(map(ord, city)) % 25}})
+
+    async def openfoodfacts(self, request: web.Request) -> web.Response:
+        if not await self._delay("openfoodfacts"):
+            return web.json_response({"products": []}, status=503)
+        name = request.query.get("search_terms", "")
+        return web.json_response({"products": [{
+            "product_name": name,
+            "nutriments": {"energy-kcal_100g": 50 + sum(map(ord, name)) % 300},
+        }]})
+
+    async def fatsecret(self, request: web.Request) -> web.Response:
+        if not await self._delay("fatsecret"):
+            return web.json_response({"error": {"code": 12, "message": "stub error"}}, status=503)
+        name = request.query.get("search_expression", "")
+        return web.json_response({
+            "name": name,
+            "calories": 60 + sum(map(ord, name)) % 300,
+            "protein": 1.0,
+            "fat": 1.0,
+            "carbs": 10.0,
+        })
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+
+        app = web.Application()
+        app.router.add_get("/weather", self.weather)
+        app.router.add_get("/openfoodfacts", self.openfoodfacts)
+        app.router.add_get("/fatsecret", self.fatsecret)
+
+        runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        self._loop.run_until_complete(site.start())
+        self.port = runner.addresses[0][1]
+        self._ready.set()
+
+        self._loop.run_forever()
+        self._loop.run_until_complete(runner.cleanup())
+
+    def start(self) -> None:
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.port}/{path}"
+
+
+def configure_environment(stubs: StubApis) -> None:
+    defaults = {
+        "BOT_TOKEN": "123456:" + "A" * 35,
+        "WEATHER_API_KEY": "benchmark",
+        "CONSUMER_KEY": "benchmark",
+        "CONSUMER_SECRET": "benchmark",
+        "LOG_LEVEL": "WARNING",
+        "NUTRITION_CACHE_PATH": "",
+        "SENDER_GLOBAL_RATE": "1000000",
+        "SENDER_CHAT_RATE": "1000000",
+        "SENDER_CHAT_BURST": "1000000",
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+    os.environ["WEATHER_API_URL"] = stubs.url("weather")
+    os.environ["OPENFOODFACTS_API_URL"] = stubs.url("openfoodfacts")
+    os.environ["BENCHMARK_FATSECRET_URL"] = stubs.url("fatsecret")
+
+
+def stub_search_fatsecret(name: str) -> Optional[Dict]:
+    query = urllib.parse.urlencode({"search_expression": name})
+    with urllib.request.urlopen(f"{os.environ['BENCHMARK_FATSECRET_URL']}?{query}", timeout=10) as response:
+        return json.loads(response.read())
+
+
+def build_script(scenario: str, city: str, food: str) -> List[str]:
+    return {
+        "profile": ["/profile", "70", "180", "30", "45", city],
+        "water": ["/water 250"],
+        "food": [f"/food {food}", "150"],
+        "workout": ["/workout run", "30"],
+        "progress": ["/progress"],
+        "charts": ["/charts"],
+        "history": ["/history", "7"],
+    }[scenario]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(max(values) * 1000, 3) if values else 0.0,
+    }
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+async def run_benchmark(args) -> Dict:
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendMessage, SendPhoto
+    from aiogram.types import Chat, Message, Update, User
+
+    import bot
+    import utils
+    from sender import sender
+
+    utils._search_fatsecret = stub_search_fatsecret
+
+    replies = {"messages": 0, "photos": 0}
+
+    class FakeSession(BaseSession):
+        async def make_request(self, telegram_bot, method, timeout=None):
+            if args.telegram_latency:
+                await asyncio.sleep(args.telegram_latency)
+            if isinstance(method, SendPhoto):
+                replies["photos"] += 1
+            elif isinstance(method, SendMessage):
+                replies["messages"] += 1
+            else:
+                return True
+            return Message(
+                message_id=1,
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=getattr(method, "text", None),
+            )
+
+        async def close(self) -> None:
+            pass
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+    ids = itertools.count(1)
+
+    def make_update(uid: int, text: str) -> Update:
+        user = User(id=uid, is_bot=False, first_name=f"user{uid}")
+        return Update(update_id=next(ids), message=Message(
+            message_id=next(ids),
+            date=datetime.now(),
+            chat=Chat(id=uid, type="private"),
+            from_user=user,
+            text=text,
+        ))
+
+    utils.set_http_session(utils.create_http_session())
+    telegram_bot = Bot(token=os.environ["BOT_TOKEN"], session=FakeSession())
+    dispatcher = Dispatcher(storage=bot.create_fsm_storage(), events_isolation=bot.user_locks)
+    dispatcher.include_router(bot.router)
+    await bot.user_repository.start()
+    sender.start(telegram_bot)
+
+    latencies: Dict[str, List[float]] = {name: [] for name in args.scenarios}
+    errors: Dict[str, int] = {name: 0 for name in args.scenarios}
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def run_user(uid: int) -> None:
+        city_index = uid % args.cities
+        food_index = uid % args.foods
+        city = f"{CITIES[city_index % len(CITIES)]}-{city_index}"
+        food = f"{FOODS[food_index % len(FOODS)]} {food_index}"
+
+        async with slots:
+            for round_number in range(args.rounds):
+                for scenario in args.scenarios:
+                    if scenario == "profile" and round_number:
+                        continue
+                    for text in build_script(scenario, city, food):
+                        started = time.perf_counter()
+                        try:
+                            await dispatcher.feed_update(telegram_bot, make_update(uid, text))
+                        except Exception:
+                            errors[scenario] += 1
+                        latencies[scenario].append(time.perf_counter() - started)
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(run_user(1_000_000 + uid) for uid in range(args.users)))
+        elapsed = time.perf_counter() - started
+        await sender.close(timeout=60)
+    finally:
+        await monitor.stop()
+        await telegram_bot.session.close()
+        await bot.user_repository.close()
+        await dispatcher.storage.close()
+        await utils.close_http_session()
+        utils.shutdown_fatsecret_executor()
+        utils.nutrition_cache.close()
+        executor = utils._chart_executor
+        utils._chart_executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    updates = sum(len(values) for values in latencies.values())
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+
+    return {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "rounds": args.rounds,
+        "scenarios": list(args.scenarios),
+        "stub_latency_ms": args.stub_latency * 1000,
+        "telegram_latency_ms": args.telegram_latency * 1000,
+        "elapsed_s": round(elapsed, 3),
+        "updates": updates,
+        "throughput_updates_per_s": round(updates / elapsed, 1) if elapsed else 0.0,
+        "latency": summarize([value for values in latencies.values() for value in values]),
+        "latency_by_scenario": {name: summarize(values) for name, values in latencies.items()},
+        "errors": errors,
+        "loop_lag": summarize(monitor.samples),
+        "peak_rss_mb": round(self_rss * rss_unit / 2 ** 20, 1),
+        "peak_rss_chart_workers_mb": round(children_rss * rss_unit / 2 ** 20, 1),
+        "replies": replies,
+        "stub_requests": dict(args.stubs.requests),
+        "caches": {
+            "weather": utils.temperature_cache.stats(),
+            "nutrition": utils.nutrition_cache.stats(),
+            "charts": utils.chart_cache.stats(),
+        },
+        "sender": sender.stats(),
+        "settings": {
+            name: os.environ.get(name)
+            for name in ("STORAGE_BACKEND", "FSM_STORAGE", "CHART_DPI", "CHART_FORMAT", "CHART_WORKERS")
+            if os.environ.get(name) is not None
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test for the bot handlers with stubbed external APIs")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=500, help="users running their dialogues at the same time")
+    parser.add_argument("--rounds", type=int, default=1, help="how many times each user repeats the non-profile scenarios")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--cities", type=int, default=50, help="distinct cities across users")
+    parser.add_argument("--foods", type=int, default=200, help="distinct food queries across users")
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="mean latency of stubbed APIs (sec)")
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="latency of the fake Telegram session (sec)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report to this file as well as stdout")
+    args = parser.parse_args()
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if "profile" not in args.scenarios:
+        args.scenarios.insert(0, "profile")
+
+    random.seed(args.seed)
+    args.stubs = StubApis(args.stub_latency, args.stub_error_rate)
+    args.stubs.start()
+    configure_environment(args.stubs)
+
+    try:
+        report = asyncio.run(run_benchmark(args))
+    finally:
+        args.stubs.stop()
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
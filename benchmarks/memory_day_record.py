@@ -0,0 +1,104 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+for name in ("BOT_TOKEN", "WEATHER_API_KEY", "CONSUMER_KEY", "CONSUMER_SECRET"):
+    os.environ.setdefault(name, "benchmark")
+
+from models import DayRecord, FoodEntry, WorkoutEntry  # noqa: E402
+
+
+@dataclass
+class LegacyDayRecord:
+    date: str
+    logged_water: float = 0
+    logged_calories: float = 0
+    burned_calories: float = 0
+    water_goal: float = 0
+    calorie_goal: float = 0
+    temperature: float = 0
+    food_log: List[Dict] = field(default_factory=list)
+    workout_log: List[Dict] = field(default_factory=list)
+
+
+def build_legacy(days: int, foods: int, workouts: int) -> list:
+    now = time.time()
+    records = []
+    for day in range(days):
+        record = LegacyDayRecord(date=f"2024-01-{day % 28 + 1:02d}", logged_water=1500.0,
+                                 logged_calories=2100.0, water_goal=2800.0, calorie_goal=2300.0)
+        for i in range(foods):
+            record.food_log.append({
+                "name": f"food {i}",
+                "weight": 150.0,
+                "calories": 210.0,
+                "timestamp": datetime.fromtimestamp(now + i).isoformat(),
+            })
+        for i in range(workouts):
+            record.workout_log.append({
+                "type": "run",
+                "duration": 30,
+                "calories": 360,
+                "timestamp": datetime.fromtimestamp(now + i).isoformat(),
+            })
+        records.append(record)
+    return records
+
+
+def build_slotted(days: int, foods: int, workouts: int) -> list:
+    now = int(time.time())
+    records = []
+    for day in range(days):
+        record = DayRecord(date=f"2024-01-{day % 28 + 1:02d}", logged_water=1500.0,
+                           logged_calories=2100.0, water_goal=2800.0, calorie_goal=2300.0)
+        for i in range(foods):
+            record.food_log.append(FoodEntry(name=f"food {i}", weight=150.0,
+                                             calories=210.0, timestamp=now + i))
+        for i in range(workouts):
+            record.workout_log.append(WorkoutEntry(type="run", duration=30,
+                                                   calories=360, timestamp=now + i))
+        records.append(record)
+    return records
+
+
+def measure(builder, days: int, foods: int, workouts: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    records = builder(days, foods, workouts)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return current / days
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bytes per user-day for DayRecord representations")
+    parser.add_argument("--days", type=int, default=20000)
+    parser.add_argument("--foods", type=int, default=4)
+    parser.add_argument("--workouts", type=int, default=1)
+    args = parser.parse_args()
+
+    legacy = measure(build_legacy, args.days, args.foods, args.workouts)
+    slotted = measure(build_slotted, args.days, args.foods, args.workouts)
+
+    print(json.dumps({
+        "days": args.days,
+        "foods_per_day": args.foods,
+        "workouts_per_day": args.workouts,
+        "legacy_bytes_per_day": round(legacy),
+        "slotted_bytes_per_day": round(slotted),
+        "reduction": round(1 - slotted / legacy, 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
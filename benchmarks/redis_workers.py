@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+for name in ("BOT_TOKEN", "WEATHER_API_KEY", "CONSUMER_KEY", "CONSUMER_SECRET"):
+    os.environ.setdefault(name, "benchmark")
+os.environ.setdefault("NUTRITION_CACHE_PATH", "")
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+
+from models import DayRecord, UserProfile  # noqa: E402
+from storage import RedisUserEventIsolation, RedisUserRepository  # noqa: E402
+
+DAY = "2024-01-01"
+PREFIX = "workers_check"
+
+
+def make_client(url: str):
+    if url:
+        from redis.asyncio import Redis
+
+        return Redis.from_url(url)
+
+    import fakeredis
+
+    if not hasattr(make_client, "server"):
+        make_client.server = fakeredis.FakeServer()
+    return fakeredis.FakeAsyncRedis(server=make_client.server)
+
+
+def make_worker(url: str) -> RedisUserRepository:
+    repository = RedisUserRepository(make_client(url), max_resident=100, flush_interval=3600, key_prefix=PREFIX)
+    repository.locks = RedisUserEventIsolation(make_client(url), PREFIX)
+    return repository
+
+
+async def stored_day(repository: RedisUserRepository, user_id: int) -> Dict:
+    payload = await repository._load(user_id)
+    return json.loads(payload)["daily_stats"][DAY]
+
+
+async def stored_water(repository: RedisUserRepository, user_id: int) -> float:
+    return (await stored_day(repository, user_id))["logged_water"]
+
+
+async def log_water(repository: RedisUserRepository, user_id: int, amount: float) -> None:
+    profile = await repository.get(user_id)
+    profile.log_water(profile.daily_stats[DAY], amount)
+    repository.mark_dirty(profile)
+    await repository.commit(user_id)
+
+
+async def check_sequential_updates(workers: List[RedisUserRepository]) -> Dict:
+    first, second = workers
+    profile = UserProfile(1, 70, 180, 30, 30, "Moscow", daily_stats={DAY: DayRecord(date=DAY)})
+    await first.save(profile)
+    await first.commit(1)
+    await second.get(1)
+
+    await log_water(first, 1, 500)
+    await log_water(second, 1, 300)
+    water = await stored_water(first, 1)
+    return {"expected": 800, "stored": water, "passed": water == 800}
+
+
+async def check_stale_write(workers: List[RedisUserRepository]) -> Dict:
+    first, second = workers
+    profile = UserProfile(2, 70, 180, 30, 30, "Moscow", daily_stats={DAY: DayRecord(date=DAY)})
+    await first.save(profile)
+    await first.flush()
+
+    copies = [await worker.get(2) for worker in workers]
+    for worker, copy, amount in zip(workers, copies, (500, 300)):
+        copy.log_water(copy.daily_stats[DAY], amount)
+        worker.mark_dirty(copy)
+
+    conflicts = second.conflicts
+    await first.flush()
+    await second.flush()
+    water = await stored_water(first, 2)
+    rejected = second.conflicts - conflicts
+
+    reloaded = await second.get(2)
+    return {
+        "stored": water,
+        "rejected_writes": rejected,
+        "reloaded_water": reloaded.daily_stats[DAY].logged_water,
+        "passed": water == 500 and rejected == 1 and reloaded.daily_stats[DAY].logged_water == 500,
+    }
+
+
+async def check_background_write(workers: List[RedisUserRepository]) -> Dict:
+    handler, background = workers
+    profile = UserProfile(4, 70, 180, 30, 30, "Moscow", daily_stats={DAY: DayRecord(date=DAY)})
+    await handler.save(profile)
+    await handler.commit(4)
+    await background.get(4)
+
+    async def recalculate(copy: UserProfile) -> bool:
+        copy.daily_stats[DAY].water_goal = 2500
+        return True
+
+    key = StorageKey(bot_id=1, chat_id=4, user_id=4)
+    async with handler.locks.lock(key):
+        copy = await handler.get(4)
+        update = asyncio.ensure_future(background.update(4, recalculate))
+        await asyncio.sleep(0.3)
+        copy.log_water(copy.daily_stats[DAY], 500)
+        handler.mark_dirty(copy)
+        committed = await handler.commit(4)
+    await update
+
+    day = await stored_day(handler, 4)
+    return {
+        "handler_committed": committed,
+        "stored_water": day["logged_water"],
+        "stored_water_goal": day["water_goal"],
+        "passed": committed and day["logged_water"] == 500 and day["water_goal"] == 2500,
+    }
+
+
+async def check_new_profile(workers: List[RedisUserRepository]) -> Dict:
+    first, second = workers
+    profile = UserProfile(5, 70, 180, 30, 30, "Moscow", daily_stats={DAY: DayRecord(date=DAY)})
+    await first.save(profile)
+    await first.commit(5)
+    await log_water(first, 5, 100)
+
+    recreated = UserProfile(5, 80, 180, 30, 30, "Kazan", daily_stats={DAY: DayRecord(date=DAY)})
+    committed = False
+    async with second.lock(5):
+        await second.save(recreated)
+        committed = await second.commit(5)
+
+    stored = json.loads(await first._load(5))
+    return {
+        "committed": committed,
+        "stored_city": stored["city"],
+        "passed": committed and stored["city"] == "Kazan",
+    }
+
+
+async def check_concurrent_updates(workers: List[RedisUserRepository], updates: int) -> Dict:
+    profile = UserProfile(3, 70, 180, 30, 30, "Moscow", daily_stats={DAY: DayRecord(date=DAY)})
+    await workers[0].save(profile)
+    await workers[0].commit(3)
+
+    key = StorageKey(bot_id=1, chat_id=3, user_id=3)
+
+    async def update(index: int) -> None:
+        worker = workers[index % len(workers)]
+        async with worker.locks.lock(key):
+            await log_water(worker, 3, 10)
+
+    await asyncio.gather(*(update(index) for index in range(updates)))
+    water = await stored_water(workers[0], 3)
+    return {"expected": updates * 10, "stored": water, "passed": water == updates * 10}
+
+
+async def run(url: str, updates: int) -> Dict:
+    workers = [make_worker(url), make_worker(url)]
+    await workers[0].redis.delete(*[key async for key in workers[0].redis.scan_iter(f"{PREFIX}:*")] or ["-"])
+    try:
+        report = {
+            "redis": url or "fakeredis",
+            "sequential_updates": await check_sequential_updates(workers),
+            "stale_write": await check_stale_write(workers),
+            "background_write": await check_background_write(workers),
+            "new_profile": await check_new_profile(workers),
+            "concurrent_updates": await check_concurrent_updates(workers, updates),
+        }
+    finally:
+        for worker in workers:
+            await worker.redis.aclose()
+            await worker.locks.close()
+
+    report["passed"] = all(check["passed"] for check in report.values() if isinstance(check, dict))
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Two workers sharing RedisUserRepository must not lose updates")
+    parser.add_argument("--redis-url", default="", help="real Redis to use instead of fakeredis")
+    parser.add_argument("--updates", type=int, default=200)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.redis_url, args.updates))
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+BASELINE_MODULES = "aiogram, aiohttp"
+LAZY_MODULES = ("matplotlib", "numpy", "fatsecret", "redis")
+
+
+def import_profile(statement: str) -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    env = dict(os.environ)
+    env.setdefault("NUTRITION_CACHE_PATH", "")
+    env["PYTHONPATH"] = SRC + os.pathsep + env.get("PYTHONPATH", "")
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=SRC,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    modules: Dict[str, Tuple[int, int]] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+
+    total_us = sum(self_us for self_us, _ in modules.values())
+    return total_us / 1000, modules
+
+
+def top_level(name: str) -> str:
+    return name.split(".", 1)[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import-time profile of src/bot.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=300,
+                        help="budget for import time on top of aiogram and aiohttp")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    baseline_runs: List[float] = []
+    bot_runs: List[float] = []
+    overhead_runs: List[float] = []
+    modules: Dict[str, Tuple[int, int]] = {}
+
+    import_profile("import bot")
+
+    for _ in range(args.runs):
+        baseline_ms, baseline = import_profile(f"import {BASELINE_MODULES}")
+        bot_ms, modules = import_profile("import bot")
+
+        own = [self_us for name, (self_us, _) in modules.items() if name not in baseline]
+        baseline_runs.append(baseline_ms)
+        bot_runs.append(bot_ms)
+        overhead_runs.append(sum(own) / 1000)
+
+    by_package: Dict[str, int] = {}
+    for name, (self_us, _) in modules.items():
+        by_package[top_level(name)] = by_package.get(top_level(name), 0) + self_us
+    heaviest = sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    loaded_lazy = sorted({top_level(name) for name in modules} & set(LAZY_MODULES))
+    overhead_ms = statistics.median(overhead_runs)
+    passed = overhead_ms <= args.budget_ms and not loaded_lazy
+
+    print(json.dumps({
+        "runs": args.runs,
+        "import_bot_ms": round(statistics.median(bot_runs), 1),
+        "baseline_ms": round(statistics.median(baseline_runs), 1),
+        "baseline_modules": BASELINE_MODULES,
+        "overhead_ms": round(overhead_ms, 1),
+        "budget_ms": args.budget_ms,
+        "eagerly_loaded_lazy_modules": loaded_lazy,
+        "heaviest_packages_ms": {name: round(us / 1000, 1) for name, us in heaviest},
+        "passed": passed,
+    }, indent=2))
+
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import logger, settings
+from models import UserProfile
+from storage import UserRepository, create_user_repository
+
+
+FORMATS = ("ndjson", "csv", "parquet")
+
+
+def _int(value: Any) -> int:
+    return int(float(value))
+
+
+def _optional_float(value: Any) -> Optional[float]:
+    return float(value) if value not in ("", None) else None
+
+
+PROFILE_COLUMNS = {
+    "user_id": _int, "weight": float, "height": float, "age": _int, "activity_minutes": _int, "city": str,
+    "summary": str,
+}
+DAY_COLUMNS = {
+    "user_id": _int, "date": str, "logged_water": float, "logged_calories": float, "burned_calories": float,
+    "water_goal": float, "calorie_goal": float, "temperature": _optional_float,
+}
+FOOD_COLUMNS = {
+    "user_id": _int, "date": str, "name": str, "weight": float, "calories": float, "timestamp": _int,
+}
+WORKOUT_COLUMNS = {
+    "user_id": _int, "date": str, "type": str, "duration": _int, "calories": float, "timestamp": _int,
+}
+TABLES = {
+    "profiles": PROFILE_COLUMNS,
+    "days": DAY_COLUMNS,
+    "foods": FOOD_COLUMNS,
+    "workouts": WORKOUT_COLUMNS,
+}
+
+
+def _open_text(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def flatten(profile: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    user_id = profile["user_id"]
+    summary = profile.get("summary")
+    rows: Dict[str, List[Dict[str, Any]]] = {
+        "profiles": [{
+            **{column: profile[column] for column in PROFILE_COLUMNS if column != "summary"},
+            "summary": json.dumps(summary) if summary else "",
+        }],
+        "days": [],
+        "foods": [],
+        "workouts": [],
+    }
+
+    for key in sorted(profile.get("daily_stats", {})):
+        record = profile["daily_stats"][key]
+        day = {column: record.get(column, 0) for column in DAY_COLUMNS if column != "user_id"}
+        rows["days"].append({"user_id": user_id, **day})
+        for entry in record.get("food_log", []):
+            rows["foods"].append({"user_id": user_id, "date": key, **entry})
+        for entry in record.get("workout_log", []):
+            rows["workouts"].append({"user_id": user_id, "date": key, **entry})
+    return rows
+
+
+class NdjsonWriter:
+    def __init__(self, path: str):
+        self.paths = [path]
+        self._file = _open_text(path, "w")
+
+    def write(self, profiles: List[Dict[str, Any]]) -> None:
+        self._file.writelines(json.dumps(profile, ensure_ascii=False) + "\n" for profile in profiles)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class CsvWriter:
+    def __init__(self, directory: str, compress: bool):
+        os.makedirs(directory, exist_ok=True)
+        suffix = ".csv.gz" if compress else ".csv"
+
+        self.paths = []
+        self._files = {}
+        self._writers = {}
+        for table, columns in TABLES.items():
+            path = os.path.join(directory, table + suffix)
+            self.paths.append(path)
+            self._files[table] = _open_text(path, "w")
+            self._writers[table] = csv.DictWriter(self._files[table], fieldnames=list(columns))
+            self._writers[table].writeheader()
+
+    def write(self, profiles: List[Dict[str, Any]]) -> None:
+        for profile in profiles:
+            for table, rows in flatten(profile).items():
+                self._writers[table].writerows(rows)
+
+    def close(self) -> None:
+        for file in self._files.values():
+            file.close()
+
+
+class ParquetWriter:
+    def __init__(self, directory: str, compress: bool):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Для экспорта в parquet требуется пакет pyarrow") from None
+
+        self._pa = pyarrow
+        types = {
+            _int: pyarrow.int64(), float: pyarrow.float64(), _optional_float: pyarrow.float64(), str: pyarrow.string(),
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        self.paths = []
+        self._schemas = {}
+        self._writers = {}
+        for table, columns in TABLES.items():
+            path = os.path.join(directory, table + ".parquet")
+            self.paths.append(path)
+            self._schemas[table] = pyarrow.schema([(name, types[kind]) for name, kind in columns.items()])
+            self._writers[table] = pyarrow.parquet.ParquetWriter(
+                path, self._schemas[table], compression="zstd" if compress else "snappy"
+            )
+
+    def write(self, profiles: List[Dict[str, Any]]) -> None:
+        tables: Dict[str, List[Dict[str, Any]]] = {table: [] for table in TABLES}
+        for profile in profiles:
+            for table, rows in flatten(profile).items():
+                tables[table].extend(rows)
+
+        for table, rows in tables.items():
+            if rows:
+                self._writers[table].write_table(
+                    self._pa.Table.from_pylist(rows, schema=self._schemas[table])
+                )
+
+    def close(self) -> None:
+        for writer in self._writers.values():
+            writer.close()
+
+
+def _create_writer(path: str, fmt: str, compress: bool):
+    if fmt == "ndjson":
+        if compress and not path.endswith(".gz"):
+            path += ".gz"
+        return NdjsonWriter(path)
+    if fmt == "csv":
+        return CsvWriter(path, compress)
+    if fmt == "parquet":
+        return ParquetWriter(path, compress)
+    raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+
+
+def _count(profiles: List[Dict[str, Any]], stats: Dict[str, int]) -> None:
+    for profile in profiles:
+        stats["users"] += 1
+        for record in profile.get("daily_stats", {}).values():
+            stats["days"] += 1
+            stats["foods"] += len(record.get("food_log", []))
+            stats["workouts"] += len(record.get("workout_log", []))
+
+
+def _count_profiles(profiles: List[UserProfile], stats: Dict[str, int]) -> None:
+    for profile in profiles:
+        stats["users"] += 1
+        for record in profile.daily_stats.values():
+            stats["days"] += 1
+            stats["foods"] += len(record.food_log)
+            stats["workouts"] += len(record.workout_log)
+
+
+async def export_users(
+    repository: UserRepository,
+    path: str,
+    fmt: str = "ndjson",
+    compress: bool = False,
+    batch_size: int = settings.export_batch_size,
+) -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    stats = {"users": 0, "days": 0, "foods": 0, "workouts": 0}
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="export") as executor:
+        writer = await loop.run_in_executor(executor, _create_writer, path, fmt, compress)
+        try:
+            async for profiles in repository.iter_all(batch_size):
+                await loop.run_in_executor(executor, writer.write, profiles)
+                _count(profiles, stats)
+        finally:
+            await loop.run_in_executor(executor, writer.close)
+
+    logger.info("Экспорт %s завершён: %s пользователей", fmt, stats["users"])
+    return {**stats, "paths": writer.paths}
+
+
+def _batched(profiles: Iterator[Dict[str, Any]], batch_size: int) -> Iterator[List[UserProfile]]:
+    batch: List[UserProfile] = []
+    for profile in profiles:
+        batch.append(UserProfile.from_dict(profile))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_ndjson(path: str) -> Iterator[Dict[str, Any]]:
+    with _open_text(path, "r") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _typed_rows(path: str, columns: Dict[str, Callable]) -> Iterator[Dict[str, Any]]:
+    with _open_text(path, "r") as file:
+        for row in csv.DictReader(file):
+            yield {name: columns[name](row.get(name, "")) for name in columns}
+
+
+class _Peekable:
+    def __init__(self, rows: Iterator[Dict[str, Any]]):
+        self._rows = rows
+        self.head: Optional[Dict[str, Any]] = next(rows, None)
+
+    def take_while(self, key: Tuple, fields: Tuple[str, ...]) -> Iterator[Dict[str, Any]]:
+        while self.head is not None and tuple(self.head[name] for name in fields) == key:
+            yield self.head
+            self.head = next(self._rows, None)
+
+
+def _csv_path(directory: str, table: str) -> str:
+    path = os.path.join(directory, table + ".csv")
+    return path if os.path.exists(path) else path + ".gz"
+
+
+def read_csv(directory: str) -> Iterator[Dict[str, Any]]:
+    days = _Peekable(_typed_rows(_csv_path(directory, "days"), DAY_COLUMNS))
+    foods = _Peekable(_typed_rows(_csv_path(directory, "foods"), FOOD_COLUMNS))
+    workouts = _Peekable(_typed_rows(_csv_path(directory, "workouts"), WORKOUT_COLUMNS))
+
+    for profile in _typed_rows(_csv_path(directory, "profiles"), PROFILE_COLUMNS):
+        summary = profile.pop("summary")
+        if summary:
+            profile["summary"] = json.loads(summary)
+
+        user_id = profile["user_id"]
+        daily_stats = {}
+        for day in days.take_while((user_id,), ("user_id",)):
+            key = day.pop("date")
+            day.pop("user_id")
+            day_key = (user_id, key)
+            day["food_log"] = [
+                {name: row[name] for name in FOOD_COLUMNS if name not in ("user_id", "date")}
+                for row in foods.take_while(day_key, ("user_id", "date"))
+            ]
+            day["workout_log"] = [
+                {name: row[name] for name in WORKOUT_COLUMNS if name not in ("user_id", "date")}
+                for row in workouts.take_while(day_key, ("user_id", "date"))
+            ]
+            daily_stats[key] = {"date": key, **day}
+        yield {**profile, "daily_stats": daily_stats}
+
+
+def detect_format(path: str) -> str:
+    if os.path.isdir(path):
+        return "csv"
+    return "ndjson"
+
+
+async def import_users(
+    repository: UserRepository,
+    path: str,
+    fmt: Optional[str] = None,
+    batch_size: int = settings.export_batch_size,
+) -> Dict[str, int]:
+    fmt = fmt or detect_format(path)
+    if fmt == "ndjson":
+        source = read_ndjson(path)
+    elif fmt == "csv":
+        source = read_csv(path)
+    else:
+        raise ValueError(f"Импорт из формата {fmt} не поддерживается")
+
+    loop = asyncio.get_running_loop()
+    stats = {"users": 0, "days": 0, "foods": 0, "workouts": 0}
+    batches = _batched(source, batch_size)
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="import") as executor:
+        try:
+            while True:
+                profiles = await loop.run_in_executor(executor, next, batches, None)
+                if profiles is None:
+                    break
+                await repository.import_many(profiles)
+                await repository.flush()
+                _count_profiles(profiles, stats)
+        finally:
+            await loop.run_in_executor(executor, batches.close)
+
+    logger.info("Импорт %s завершён: %s пользователей", fmt, stats["users"])
+    return stats
+
+
+async def run_cli(args: argparse.Namespace) -> Dict[str, Any]:
+    repository = create_user_repository()
+    await repository.start()
+    try:
+        if args.command == "export":
+            return await export_users(repository, args.output, args.format, args.gzip, args.batch_size)
+        return await import_users(repository, args.input, args.format, args.batch_size)
+    finally:
+        await repository.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Выгрузка и загрузка истории пользователей")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("output", help="файл .ndjson или каталог для csv/parquet")
+    export_parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    export_parser.add_argument("--gzip", action="store_true")
+    export_parser.add_argument("--batch-size", type=int, default=settings.export_batch_size)
+
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument("input", help="файл .ndjson[.gz] или каталог с csv")
+    import_parser.add_argument("--format", choices=("ndjson", "csv"))
+    import_parser.add_argument("--batch-size", type=int, default=settings.export_batch_size)
+
+    args = parser.parse_args()
+    if settings.storage_backend == "memory":
+        parser.error(
+            "STORAGE_BACKEND=memory хранит профили только внутри процесса бота, выгружать и загружать нечего: "
+            "задайте STORAGE_BACKEND=sqlite или redis"
+        )
+
+    print(json.dumps(asyncio.run(run_cli(args)), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
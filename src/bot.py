@@ -1,13 +1,43 @@
+import os
+import random
+import time
 from datetime import datetime, timedelta
 from aiogram.types import Message, BufferedInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command, CommandObject
 import asyncio
 from aiogram.fsm.state import State, StatesGroup
-from utils import fetch_city_temperature, build_daily_charts, lookup_food_fatsecret
-from config import BOT_TOKEN, WATER_PER_WORKOUT, WEATHER_API_KEY, WORKOUT_CALORIES, logger
+from utils import (
+    fetch_city_temperature,
+    build_daily_charts,
+    build_trend_charts,
+    create_http_session,
+    set_http_session,
+    close_http_session,
+    shutdown_fatsecret_executor,
+    nutrition_cache,
+    shutdown_chart_executor,
+    ChartQueueFull,
+    chart_filename,
+    prewarm_heavy_modules,
+)
+from config import (
+    WATER_PER_WORKOUT,
+    WORKOUT_CALORIES,
+    settings,
+    logger,
+)
+from food_providers import FoodResolver, FatSecretProvider, OpenFoodFactsProvider
 from aiogram import Bot, Dispatcher, Router, BaseMiddleware
-from models import UserProfile
+from models import UserProfile, FoodEntry, WorkoutEntry
+from storage import create_user_repository, create_fsm_storage, create_events_isolation
+from webhook import run_webhook
+from sender import sender, answer, answer_photo
+from metrics import MetricsMiddleware, register_stats, start_metrics_server
+from watchdog import watchdog, HandlerTrackingMiddleware
+from scheduler import WeatherRefreshScheduler
+from retention import RetentionCompactor
+from backup import FORMATS, export_users, import_users
 
 class UserProfileFSM(StatesGroup): 
     input_weight = State()
@@ -34,15 +64,60 @@ class TrainingFSM(StatesGroup):
     confirm_training = State()
 
 
-users: dict[int, UserProfile] = {}
+user_locks = create_events_isolation()
+user_repository = create_user_repository(user_locks)
 router = Router()
 
+food_resolver = FoodResolver(
+    providers=[FatSecretProvider(), OpenFoodFactsProvider()],
+    deadline=settings.food_lookup_deadline,
+    cache=nutrition_cache,
+    stagger=settings.food_provider_stagger,
+)
+
+register_stats(
+    "bot_food_provider",
+    "Food provider statistics",
+    "provider",
+    {name: stats.as_dict for name, stats in food_resolver.stats.items()},
+    ["calls", "errors", "wins", "latency", "error_rate"],
+)
+
+weather_scheduler = WeatherRefreshScheduler(
+    repository=user_repository,
+    api_key=settings.weather_api_key,
+    interval=settings.weather_refresh_interval,
+    concurrency=settings.weather_refresh_concurrency,
+)
+
+register_stats(
+    "bot_weather_refresh",
+    "Background weather refresh statistics",
+    "scheduler",
+    {"weather": weather_scheduler.stats},
+    ["runs", "cities", "failed", "updated_profiles", "last_duration"],
+)
+
+retention_compactor = RetentionCompactor(
+    user_repository,
+    keep_days=settings.retention_days,
+    interval=settings.retention_interval,
+    spill_dir=settings.retention_spill_dir,
+)
+register_stats(
+    "bot_retention",
+    "Background compaction of old history",
+    "task",
+    {"retention": retention_compactor.stats},
+    ["runs", "compacted_profiles", "compacted_days", "spilled_days", "last_duration"],
+)
+
 
 class UserProfileGuardMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: Message, data: dict):
         uid = event.from_user.id
 
-        allowed_commands = {"/start", "/help", "/profile"}
+        allowed_commands = {"/start", "/help", "/profile", "/export", "/import"}
         message_text = event.text or ""
         current_state = data.get("raw_state")
 
@@ -55,8 +130,9 @@ class UserProfileGuardMiddleware(BaseMiddleware):
         if is_allowed_command or is_in_profile_fsm:
             return await handler(event, data)
 
-        if uid not in users:
-            await event.answer(
+        if await user_repository.get(uid) is None:
+            await answer(
+                event,
                 "Сначала нужно заполнить профиль. Используйте команду /profile."
             )
             return
@@ -64,27 +140,48 @@ class UserProfileGuardMiddleware(BaseMiddleware):
         return await handler(event, data)
 
 
-class ActivityLoggerMiddleware(BaseMiddleware):
+class ProfileCommitMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: Message, data: dict):
-        logger.info("Пользователь %s написал: %s", event.from_user.id, event.text)
-        return await handler(event, data)
-    
+        try:
+            return await handler(event, data)
+        finally:
+            await user_repository.commit(event.from_user.id)
+
+
 class ActivityLoggerMiddleware(BaseMiddleware):
+    def __init__(self, sample_rate: float):
+        self.sample_rate = sample_rate
+
     async def __call__(self, handler, event: Message, data: dict):
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return await handler(event, data)
+
         user = event.from_user
         text = event.text
+        started = time.perf_counter()
 
-        logger.info(
-            "Сообщение от пользователя %s: %s",
-            user.id,
-            text
-        )
-
-        result = await handler(event, data)
-        return result
+        try:
+            return await handler(event, data)
+        finally:
+            handler_object = data.get("handler")
+            logger.info(
+                "Сообщение от пользователя %s: %s",
+                user.id,
+                text,
+                extra={
+                    "user_id": user.id,
+                    "command": text.split()[0] if text and text.startswith("/") else None,
+                    "state": data.get("raw_state"),
+                    "handler": handler_object.callback.__name__ if handler_object else None,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                }
+            )
 
 
-router.message.middleware(ActivityLoggerMiddleware())
+router.message.middleware(MetricsMiddleware())
+router.message.middleware(HandlerTrackingMiddleware(watchdog))
+router.message.middleware(ActivityLoggerMiddleware(settings.log_message_sample_rate))
+router.message.middleware(ProfileCommitMiddleware())
 router.message.middleware(UserProfileGuardMiddleware())
 
 
@@ -97,13 +194,13 @@ async def start_bot_handler(message: Message):
         "/water <мл> — учесть выпитую воду",
         "/workout <тип> <мин> — записать тренировку",
         "/progress — посмотреть текущий прогресс",
-        "/charts — графики за день",
+        "/charts — графики за день, /charts 30 — динамика за 30 дней",
         "/history — история активности",
     ]
 
     response_text = intro + "Доступные команды:\n" + "\n".join(commands)
 
-    await message.answer(response_text)
+    await answer(message, response_text)
 
 
 @router.message(UserProfileFSM.input_height)
@@ -113,12 +210,12 @@ async def handle_height_input(message: Message, state: FSMContext):
     try:
         parsed_height = float(text_value)
     except ValueError:
-        await message.answer("Неверный формат. Введите число повторно:")
+        await answer(message, "Неверный формат. Введите число повторно:")
         return
 
     await state.update_data(height=parsed_height)
     await state.set_state(UserProfileFSM.input_age)
-    await message.answer("Пожалуйста, введите ваш возраст:")
+    await answer(message, "Пожалуйста, введите ваш возраст:")
 
 
 @router.message(Command("profile"))
@@ -128,7 +225,7 @@ async def start_profile_setup(message: Message, state: FSMContext):
     await state.set_state(next_step)
 
     prompt_text = "Пожалуйста, введите ваш вес (кг):"
-    await message.answer(prompt_text)
+    await answer(message, prompt_text)
 
 
 @router.message(UserProfileFSM.input_weight)
@@ -139,7 +236,7 @@ async def handle_weight_input(message: Message, state: FSMContext):
         parsed_weight = float(user_input)
     except ValueError:
         error_text = "Неверный формат. Введите число повторно:"
-        await message.answer(error_text)
+        await answer(message, error_text)
         return
 
     await state.update_data(weight=parsed_weight)
@@ -148,7 +245,7 @@ async def handle_weight_input(message: Message, state: FSMContext):
     await state.set_state(next_state)
 
     prompt = "Пожалуйста, введите ваш рост (см):"
-    await message.answer(prompt)
+    await answer(message, prompt)
 
 
 @router.message(UserProfileFSM.select_activity_level)
@@ -159,7 +256,7 @@ async def handle_activity_input(message: Message, state: FSMContext):
         parsed_activity = int(user_input)
     except ValueError:
         error_message = "Неверный формат. Введите целое число минут повторно:"
-        await message.answer(error_message)
+        await answer(message, error_message)
         return
 
     await state.update_data(activity=parsed_activity)
@@ -168,7 +265,7 @@ async def handle_activity_input(message: Message, state: FSMContext):
     await state.set_state(next_state)
 
     prompt = "Укажите, в каком городе вы находитесь:"
-    await message.answer(prompt)
+    await answer(message, prompt)
 
 
 
@@ -179,7 +276,7 @@ async def handle_age_input(message: Message, state: FSMContext):
     try:
         parsed_age = int(user_input)
     except ValueError:
-        await message.answer("Неверный формат. Введите целое число повторно:")
+        await answer(message, "Неверный формат. Введите целое число повторно:")
         return
 
     await state.update_data(age=parsed_age)
@@ -188,7 +285,7 @@ async def handle_age_input(message: Message, state: FSMContext):
     await state.set_state(next_state)
 
     prompt = "Сколько минут активности вы выполняете в день?"
-    await message.answer(prompt)
+    await answer(message, prompt)
 
 
 @router.message(UserProfileFSM.input_city_name)
@@ -207,18 +304,20 @@ async def handle_city_input(message: Message, state: FSMContext):
     )
 
     try:
-        current_temp = await fetch_city_temperature(city_name, WEATHER_API_KEY)
+        current_temp = await fetch_city_temperature(city_name, settings.weather_api_key)
         if current_temp is None:
-            await message.answer(
+            await answer(
+                message,
                 "Не удалось получить данные о температуре.\n"
                 "Проверьте корректность названия города и попробуйте снова.\n"
                 "Например: Москва, Лондон, Нью-Йорк"
             )
             return
 
-        users[uid] = user_profile
+        await user_repository.save(user_profile)
 
-        current_stats = await user_profile.  today()
+        current_stats = await user_profile.today(user_repository.update)
+        user_repository.mark_dirty(user_profile)
 
         await state.clear()
 
@@ -234,16 +333,17 @@ async def handle_city_input(message: Message, state: FSMContext):
             "/water <мл> — записать воду",
             "/workout <тип> <минуты> — записать тренировку",
             "/progress — проверить текущий прогресс",
-            "/charts — показать графики прогресса",
+            "/charts — показать графики прогресса (/charts 7, 30 или 90 — за период)",
             "/history — история активности"
         ]
         commands_text = "\n".join(commands)
 
-        await message.answer(intro + stats_info + commands_text)
+        await answer(message, intro + stats_info + commands_text)
 
     except Exception as e:
         logger.error("Ошибка при настройке профиля: %s", e)
-        await message.answer(
+        await answer(
+            message,
             "Произошла ошибка при создании профиля.\n"
             "Проверьте название города и попробуйте снова."
         )
@@ -254,28 +354,30 @@ async def handle_water_logging(message: Message, command: CommandObject, state:
     user_input = command.args
     if not user_input:
         await state.set_state(HydrationFSM.input_water_amount)
-        await message.answer("Пожалуйста, введите количество выпитой воды в мл:")
+        await answer(message, "Пожалуйста, введите количество выпитой воды в мл:")
         return
 
     uid = message.from_user.id
-    current_stats = await users[uid].  today()
+    profile = await user_repository.get(uid)
+    current_stats = await profile.today(user_repository.update)
 
     logger.debug("water_input: %s", user_input)
 
     try:
         parsed_water = float(user_input)
     except ValueError:
-        await message.answer("Неверный формат. Введите число повторно.")
+        await answer(message, "Неверный формат. Введите число повторно.")
         return
 
-    current_stats.logged_water += parsed_water
+    profile.log_water(current_stats, parsed_water)
+    user_repository.mark_dirty(profile)
     remaining = current_stats.water_goal - current_stats.logged_water
 
     response = (
         f"Записано: {parsed_water} мл воды\n"
         f"Осталось выпить: {max(0, remaining)} мл"
     )
-    await message.answer(response)
+    await answer(message, response)
 
 
 @router.message(HydrationFSM.input_water_amount)
@@ -300,14 +402,15 @@ async def handle_food_logging(message: Message, command: CommandObject, state: F
 
     if not user_input:
         await state.set_state(NutritionFSM.input_food_title)
-        await message.answer("Пожалуйста, введите название еды (на английском).")
+        await answer(message, "Пожалуйста, введите название еды (на английском).")
         return
 
-    food_info = await lookup_food_fatsecret(user_input)
+    food_info = await food_resolver.resolve(user_input)
 
     if not food_info:
         logger.error("Еда не найдена: %s", user_input)
-        await message.answer(
+        await answer(
+            message,
             "Информация о данной еде не найдена.\n"
             "Попробуйте другую еду или проверьте написание."
         )
@@ -318,7 +421,7 @@ async def handle_food_logging(message: Message, command: CommandObject, state: F
         error_msg += "Попробуйте другую еду или проверьте написание."
         if food_info.get("suggest"):
             error_msg += f"\n**Подсказка**: {food_info['suggest']}"
-        await message.answer(error_msg)
+        await answer(message, error_msg)
         return
 
     try:
@@ -334,11 +437,12 @@ async def handle_food_logging(message: Message, command: CommandObject, state: F
             f"Калории: {food_info['calories']:.1f} ккал/100г\n"
             "Сколько граммов вы съели?"
         )
-        await message.answer(prompt)
+        await answer(message, prompt)
 
     except Exception as e:
         logger.error("Ошибка при обработке информации о еде: %s", e)
-        await message.answer(
+        await answer(
+            message,
             "Произошла ошибка при обработке информации о еде.\n"
             "Попробуйте ввести другую еду."
         )
@@ -351,22 +455,23 @@ async def handle_food_weight_input(message: Message, state: FSMContext):
     try:
         weight_grams = float(user_input)
     except ValueError:
-        await message.answer("Неверный формат. Введите вес в граммах числом.")
+        await answer(message, "Неверный формат. Введите вес в граммах числом.")
         return
 
     food_info = await state.get_data()
     number_calories = food_info['calories_per_100'] * weight_grams / 100
 
     uid = message.from_user.id
-    current_stats = await users[uid].  today()
+    profile = await user_repository.get(uid)
+    current_stats = await profile.today(user_repository.update)
 
-    current_stats.logged_calories += number_calories
-    current_stats.food_log.append({
-        "name": food_info['food_name'],
-        "weight": weight_grams,
-        "calories": number_calories,
-        "timestamp": datetime.now().isoformat()
-    })
+    profile.log_food(current_stats, FoodEntry(
+        name=food_info['food_name'],
+        weight=weight_grams,
+        calories=number_calories,
+        timestamp=int(time.time())
+    ))
+    user_repository.mark_dirty(profile)
 
     await state.clear()
 
@@ -375,7 +480,7 @@ async def handle_food_weight_input(message: Message, state: FSMContext):
         f"- Вес: {weight_grams} г\n"
         f"- Калории: {number_calories:.1f} ккал"
     )
-    await message.answer(response_msg)
+    await answer(message, response_msg)
 
 
 
@@ -384,7 +489,8 @@ async def check_workout_type(message: Message, workout_name: str | None) -> bool
         return True
 
     types_hint = ", ".join(WORKOUT_CALORIES)
-    await message.answer(
+    await answer(
+        message,
         "Тип тренировки не распознан.\n"
         f"Доступные варианты: {types_hint}"
     )
@@ -413,7 +519,7 @@ async def handle_workout_duration_input(message: Message, state: FSMContext):
     try:
         duration_minutes = int(user_input)
     except ValueError:
-        await message.answer("Неверный формат. Введите продолжительность тренировки в минутах числом.")
+        await answer(message, "Неверный формат. Введите продолжительность тренировки в минутах числом.")
         return
 
     await state.update_data(workout_duration=duration_minutes)
@@ -447,22 +553,28 @@ async def handle_workout_type_input(message: Message, state: FSMContext):
     await state.set_state(next_state)
 
     prompt = "Сколько минут длилась ваша тренировка?"
-    await message.answer(prompt)
+    await answer(message, prompt)
 
 
 
 @router.message(Command("charts"))
-async def send_progress_charts(message: Message):
+async def send_progress_charts(message: Message, command: CommandObject):
     uid = message.from_user.id
 
+    if command.args:
+        await send_trend_charts(message, command.args.strip())
+        return
+
     try:
-        today_stats = await users[uid].  today()
+        profile = await user_repository.get(uid)
+        today_stats = await profile.today(user_repository.update)
+        user_repository.mark_dirty(profile)
 
         chart_buffer = await build_daily_charts(today_stats)
 
         photo_file = BufferedInputFile(
             chart_buffer.getvalue(),
-            filename="progress_charts.png"
+            filename=chart_filename("progress_charts")
         )
 
         calories_balance = today_stats.logged_calories - today_stats.calorie_goal - today_stats.water_goal
@@ -476,11 +588,64 @@ async def send_progress_charts(message: Message):
         ]
         caption_text = "\n".join(caption_lines)
 
-        await message.answer_photo(photo_file, caption=caption_text)
+        await answer_photo(message, photo_file, caption=caption_text)
+
+    except ChartQueueFull:
+        logger.warning("Очередь генерации графиков переполнена")
+        await answer(
+            message,
+            "Сейчас слишком много запросов на графики. Попробуйте чуть позже."
+        )
 
     except Exception as e:
         logger.error("Ошибка при генерации графиков: %s", e)
-        await message.answer(
+        await answer(
+            message,
+            "Произошла ошибка при генерации графиков."
+        )
+
+
+async def send_trend_charts(message: Message, period: str):
+    if not period.isdigit() or not 2 <= int(period) <= settings.chart_trend_max_days:
+        await answer(
+            message,
+            f"Укажите период в днях от 2 до {settings.chart_trend_max_days}, например: /charts 7, /charts 30, /charts 90"
+        )
+        return
+
+    days = int(period)
+    try:
+        profile = await user_repository.get(message.from_user.id)
+        await profile.today(user_repository.update)
+
+        last_day = datetime.now().date()
+        chart_buffer = await build_trend_charts(profile, days, last_day)
+        totals = profile.aggregates.totals(last_day - timedelta(days=days - 1), last_day)
+
+        photo_file = BufferedInputFile(
+            chart_buffer.getvalue(),
+            filename=chart_filename(f"trend_{days}d")
+        )
+
+        caption_lines = [
+            f"Динамика за {days} дн. (в среднем за день):",
+            f"Вода: {totals['water'] / days:.0f} мл",
+            f"Калории: {totals['calories'] / days:.0f} ккал",
+            f"Сожжено: {totals['burned'] / days:.0f} ккал",
+        ]
+        await answer_photo(message, photo_file, caption="\n".join(caption_lines))
+
+    except ChartQueueFull:
+        logger.warning("Очередь генерации графиков переполнена")
+        await answer(
+            message,
+            "Сейчас слишком много запросов на графики. Попробуйте чуть позже."
+        )
+
+    except Exception as e:
+        logger.error("Ошибка при генерации графиков за период: %s", e)
+        await answer(
+            message,
             "Произошла ошибка при генерации графиков."
         )
 
@@ -501,44 +666,47 @@ async def handle_workout_logging(message: Message, command: CommandObject, state
             if command.args and await check_workout_type(message, command.args):
                 await state.update_data(workout_type=command.args)
                 await state.set_state(TrainingFSM.enter_training_time)
-                await message.answer("Сколько минут длилась ваша тренировка?")
+                await answer(message, "Сколько минут длилась ваша тренировка?")
                 return
             await state.set_state(TrainingFSM.choose_training_type)
             types_list = ", ".join(WORKOUT_CALORIES.keys())
-            await message.answer(f"Укажите тип тренировки.\nДоступные типы: {types_list}")
+            await answer(message, f"Укажите тип тренировки.\nДоступные типы: {types_list}")
             return
 
         if not workout_duration:
             await state.set_state(TrainingFSM.enter_training_time)
-            await message.answer("Сколько минут длилась ваша тренировка?")
+            await answer(message, "Сколько минут длилась ваша тренировка?")
             return
 
-    current_stats = await users[uid].  today()
+    profile = await user_repository.get(uid)
+    current_stats = await profile.today(user_repository.update)
 
     try:
         calories = WORKOUT_CALORIES[workout_type] * workout_duration
         water_needed = (workout_duration // 30) * WATER_PER_WORKOUT
 
         current_stats.water_goal += calories
-        current_stats.workout_log.append({
-            "type": workout_type,
-            "duration": workout_duration,
-            "calories": calories,
-            "timestamp": datetime.now().isoformat()
-        })
+        profile.log_workout(current_stats, WorkoutEntry(
+            type=workout_type,
+            duration=workout_duration,
+            calories=calories,
+            timestamp=int(time.time())
+        ))
+        user_repository.mark_dirty(profile)
 
         await state.clear()
 
-        await message.answer(
+        await answer(
+            message,
             f"{workout_type.capitalize()} {workout_duration} минут\n"
             f"- Сожжено калорий: {calories} ккал\n"
             f"Рекомендуемая вода: {water_needed} мл"
         )
     except ValueError:
-        await message.answer("Неверный формат. Введите продолжительность тренировки числом.")
+        await answer(message, "Неверный формат. Введите продолжительность тренировки числом.")
     except Exception as e:
         logger.error("Ошибка при логировании тренировки: %s", e)
-        await message.answer("Произошла ошибка при регистрации тренировки.")
+        await answer(message, "Произошла ошибка при регистрации тренировки.")
 
 
 
@@ -546,18 +714,20 @@ async def handle_workout_logging(message: Message, command: CommandObject, state
 async def show_user_progress(message: Message):
 
     uid = message.from_user.id
-    profile = users[uid]
-    today_stats = await profile.today()
+    profile = await user_repository.get(uid)
+    today_stats = await profile.today(user_repository.update)
 
     try:
-        current_temp = await fetch_city_temperature(profile.city, WEATHER_API_KEY)
+        current_temp = await fetch_city_temperature(profile.city, settings.weather_api_key)
         if current_temp is not None:
             profile.recalculate_targets(current_temp)
+            user_repository.mark_dirty(profile)
 
             temp_diff = abs(current_temp - today_stats.temperature)
             if temp_diff > 5:
                 change_word = "повысилась" if current_temp > today_stats.temperature else "понизилась"
-                await message.answer(
+                await answer(
+                    message,
                     f"Температура {change_word}!\n"
                     f"Новая норма воды: {today_stats.water_goal} мл"
                 )
@@ -580,7 +750,7 @@ async def show_user_progress(message: Message):
         f"- Баланс (потреблено - BMR - потрачено): {calories_balance} ккал\n"
     )
 
-    await message.answer(progress_intro + water_info + calories_info)
+    await answer(message, progress_intro + water_info + calories_info)
 
 
 
@@ -592,27 +762,40 @@ async def handle_history_period(message: Message, state: FSMContext):
     try:
         period_days = int(user_input)
     except ValueError:
-        await message.answer("Неверный формат. Введите число от 1 до 30.")
+        await answer(message, "Неверный формат. Введите число от 1 до 30.")
         return
 
     if not 1 <= period_days <= 30:
-        await message.answer("Период должен быть от 1 до 30 дней.")
+        await answer(message, "Период должен быть от 1 до 30 дней.")
         return
 
     uid = message.from_user.id
-    profile = users[uid]
+    profile = await user_repository.get(uid)
+
+    today = datetime.now().date()
+    first_day = today - timedelta(days=period_days - 1)
+    totals = profile.aggregates.totals(first_day, today)
 
     report_lines = [f"История активности за последние {period_days} дней:\n"]
-    has_data = False
+    has_data = totals["days"] > 0
+
+    if has_data:
+        report_lines.append("Итого за период:")
+        report_lines.append(f"Вода: {totals['water']:.0f} мл")
+        report_lines.append(f"Калории: {totals['calories']:.0f} ккал")
+        report_lines.append(f"Потрачено: {totals['burned']:.0f} ккал")
+        for workout_type, minutes in totals["minutes"].items():
+            report_lines.append(f"- {workout_type.capitalize()}: {minutes:.0f} мин")
+        report_lines.append("")
 
     for offset in range(period_days-1, -1, -1):
-        date_str = (datetime.now().date() - timedelta(days=offset)).isoformat()
-        day_stats = profile.daily_stats.get(date_str)
+        day = today - timedelta(days=offset)
+        day_stats = profile.daily_stats.get(day.isoformat())
         if not day_stats:
             continue
 
         has_data = True
-        day_label = datetime.fromisoformat(date_str).strftime("%d.%m")
+        day_label = day.strftime("%d.%m")
         report_lines.append(f"{day_label}:\n")
         report_lines.append(f"Вода: {day_stats.logged_water}/{day_stats.water_goal} мл\n")
         report_lines.append(f"Калории: {day_stats.logged_calories}/{day_stats.calorie_goal} ккал\n")
@@ -621,17 +804,17 @@ async def handle_history_period(message: Message, state: FSMContext):
         if day_stats.food_log:
             report_lines.append("🍽 Питание:")
             for entry in day_stats.food_log:
-                time_str = datetime.fromisoformat(entry['timestamp']).strftime("%H:%M")
+                time_str = entry.time().strftime("%H:%M")
                 report_lines.append(
-                    f"- {time_str}: {entry['name']} ({entry['weight']}г, {entry['calories']:.1f} ккал)"
+                    f"- {time_str}: {entry.name} ({entry.weight}г, {entry.calories:.1f} ккал)"
                 )
 
         if day_stats.workout_log:
             report_lines.append("🏃‍♂️ Тренировки:")
             for entry in day_stats.workout_log:
-                time_str = datetime.fromisoformat(entry['timestamp']).strftime("%H:%M")
+                time_str = entry.time().strftime("%H:%M")
                 report_lines.append(
-                    f"- {time_str}: {entry['type'].capitalize()} ({entry['duration']} мин, {entry['calories']} ккал)"
+                    f"- {time_str}: {entry.type.capitalize()} ({entry.duration} мин, {entry.calories} ккал)"
                 )
 
         report_lines.append("") 
@@ -639,7 +822,7 @@ async def handle_history_period(message: Message, state: FSMContext):
     if not has_data:
         report_lines.append("Нет данных за выбранный период.")
 
-    await message.answer("\n".join(report_lines))
+    await answer(message, "\n".join(report_lines))
     await state.clear()
 
 
@@ -656,18 +839,120 @@ async def show_user_history(message: Message, state: FSMContext):
         "30 — Этот месяц\n\n"
         "Введите количество дней (от 1 до 30):"
     )
-    await message.answer(intro_text)
+    await answer(message, intro_text)
+
+
+def format_backup_stats(stats: dict) -> str:
+    return (
+        f"Пользователей: {stats['users']}, дней: {stats['days']}, "
+        f"приёмов пищи: {stats['foods']}, тренировок: {stats['workouts']}"
+    )
+
+
+@router.message(Command("export"))
+async def export_user_data(message: Message, command: CommandObject):
+    if message.from_user.id not in settings.admin_ids:
+        await answer(message, "Команда доступна только администраторам.")
+        return
+
+    args = (command.args or "").lower().split()
+    fmt = next((arg for arg in args if arg in FORMATS), "ndjson")
+    compress = "gzip" in args or "gz" in args
+
+    name = f"export-{datetime.now():%Y%m%d-%H%M%S}"
+    path = os.path.join(settings.export_dir, name + ".ndjson" if fmt == "ndjson" else name)
+
+    try:
+        os.makedirs(settings.export_dir, exist_ok=True)
+        stats = await export_users(user_repository, path, fmt, compress)
+    except Exception as e:
+        logger.error("Ошибка экспорта данных: %s", e)
+        await answer(message, f"Не удалось выполнить экспорт: {e}")
+        return
+
+    await answer(
+        message,
+        "Экспорт завершён.\n" + format_backup_stats(stats) + "\n" + "\n".join(stats["paths"])
+    )
+
+
+@router.message(Command("import"))
+async def import_user_data(message: Message, command: CommandObject):
+    if message.from_user.id not in settings.admin_ids:
+        await answer(message, "Команда доступна только администраторам.")
+        return
+
+    if not command.args:
+        await answer(message, "Укажите путь к файлу .ndjson или каталогу с csv: /import <путь>")
+        return
+
+    root = os.path.realpath(settings.export_dir)
+    path = os.path.realpath(os.path.join(root, command.args.strip()))
+    if os.path.commonpath([root, path]) != root or path == root:
+        await answer(message, "Путь должен указывать на файл или каталог внутри каталога выгрузок.")
+        return
+
+    if not os.path.exists(path):
+        await answer(message, f"Файл не найден: {os.path.relpath(path, root)}")
+        return
+
+    try:
+        stats = await import_users(user_repository, path)
+    except Exception as e:
+        logger.error("Ошибка импорта данных: %s", e)
+        await answer(message, f"Не удалось выполнить импорт: {e}")
+        return
+
+    await answer(message, "Импорт завершён.\n" + format_backup_stats(stats))
+
 
 async def main():
+    settings.validate()
+    set_http_session(create_http_session())
+    fsm_storage = create_fsm_storage()
+    telegram_bot = Bot(token=settings.bot_token)
+    await user_repository.start()
+    if settings.weather_refresh_interval:
+        await weather_scheduler.start()
+    if settings.retention_days and settings.retention_interval:
+        await retention_compactor.start()
+    sender.start(telegram_bot)
+    metrics_runner = None
+    prewarm_task = None
     try:
-        telegram_bot = Bot(token=BOT_TOKEN)
-        dispatcher = Dispatcher()
+        if settings.metrics_port:
+            metrics_runner = await start_metrics_server(settings.metrics_host, settings.metrics_port)
+        if settings.watchdog_threshold:
+            watchdog.start()
+        prewarm_task = asyncio.create_task(prewarm_heavy_modules())
+
+        dispatcher = Dispatcher(storage=fsm_storage, events_isolation=user_locks)
         dispatcher.include_router(router)
 
         logger.info("Бот успешно запущен!")
-        await dispatcher.start_polling(telegram_bot)
+        if settings.bot_mode == "webhook":
+            await run_webhook(dispatcher, telegram_bot)
+        else:
+            await dispatcher.start_polling(telegram_bot, close_bot_session=False)
     except Exception as error:
         logger.error("Ошибка при запуске бота: %s", error)
+    finally:
+        if prewarm_task is not None:
+            prewarm_task.cancel()
+        await watchdog.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await sender.close()
+        await telegram_bot.session.close()
+        await weather_scheduler.close()
+        await retention_compactor.close()
+        await user_repository.close()
+        await user_locks.close()
+        await fsm_storage.close()
+        await close_http_session()
+        shutdown_fatsecret_executor()
+        nutrition_cache.close()
+        shutdown_chart_executor()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: Optional[float] = None, cache_none: bool = False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.cache_none = cache_none
+
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.peek(key, _MISSING) is not _MISSING
+
+    def _lookup(self, key: Hashable, allow_expired: bool = False) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+
+        expires_at, value = entry
+        if not allow_expired and expires_at < time.monotonic():
+            return _MISSING
+
+        self._entries.move_to_end(key)
+        return value
+
+    def peek(self, key: Hashable, default: Any = None, allow_expired: bool = False) -> Any:
+        value = self._lookup(key, allow_expired)
+        return default if value is _MISSING else value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._lookup(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else float("inf")
+
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = self._lookup(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        return await self.load(key, loader)
+
+    async def load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(loader())
+        self._inflight[key] = future
+        future.add_done_callback(lambda done: self._on_loaded(key, done))
+        return await asyncio.shield(future)
+
+    def _on_loaded(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        value = future.result()
+        if value is None and not self.cache_none:
+            return
+
+        self.set(key, value)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def _singular(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("ches", "shes", "sses", "xes", "oes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def normalize_food_query(query: str) -> str:
+    return " ".join(_singular(word) for word in query.casefold().split())
+
+
+class NutritionCache:
+    def __init__(
+        self,
+        path: Optional[str],
+        maxsize: int,
+        ttl: Optional[float] = None,
+        negative_ttl: float = 600,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.negative = TTLCache(maxsize=maxsize, ttl=negative_ttl)
+
+        self._db = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.disk_errors = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nutrition-cache")
+        return self._executor
+
+    def _connect(self):
+        if self._db is None and self.path:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS foods ("
+                "query TEXT PRIMARY KEY, payload TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    async def get(self, query: str) -> Tuple[bool, Optional[Dict]]:
+        key = normalize_food_query(query)
+
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return True, value
+
+        if key in self.negative:
+            self.negative.hits += 1
+            return True, None
+
+        value = None
+        if self.path:
+            loop = asyncio.get_running_loop()
+            try:
+                value = await loop.run_in_executor(self._get_executor(), self._load_from_disk, key)
+            except sqlite3.Error:
+                self.disk_errors += 1
+        if value is not None:
+            self.disk_hits += 1
+            self.memory.set(key, value)
+            return True, value
+
+        self.disk_misses += 1
+        return False, None
+
+    def put(self, query: str, value: Optional[Dict]) -> None:
+        key = normalize_food_query(query)
+
+        if value is None:
+            self.negative.set(key, True)
+            return
+
+        if value.get("error"):
+            return
+
+        self.negative.invalidate(key)
+        self.memory.set(key, value)
+        if self.path:
+            future = self._get_executor().submit(self._store_to_disk, key, value)
+            future.add_done_callback(self._on_stored)
+
+    def _on_stored(self, future: Future) -> None:
+        if future.exception() is not None:
+            self.disk_errors += 1
+
+    def _load_from_disk(self, key: str) -> Optional[Dict]:
+        db = self._connect()
+        if db is None:
+            return None
+
+        row = db.execute(
+            "SELECT payload, updated_at FROM foods WHERE query = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        payload, updated_at = row
+        if self.ttl is not None and updated_at + self.ttl < time.time():
+            return None
+
+        return json.loads(payload)
+
+    def _store_to_disk(self, key: str, value: Dict) -> None:
+        db = self._connect()
+        if db is None:
+            return
+
+        db.execute(
+            "INSERT OR REPLACE INTO foods (query, payload, updated_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time())
+        )
+        db.commit()
+
+    def _close_db(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.submit(self._close_db)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, float]:
+        memory = self.memory.stats()
+        hits = memory["hits"] + self.disk_hits + self.negative.hits
+        lookups = hits + self.disk_misses
+        return {
+            "size": memory["size"],
+            "hits": hits,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "negative_hits": self.negative.hits,
+            "misses": self.disk_misses,
+            "negative_size": len(self.negative),
+            "disk_errors": self.disk_errors,
+        }
@@ -0,0 +1,232 @@
+import io
+import os
+from collections import OrderedDict
+from datetime import date
+from typing import List, Optional, Tuple
+
+
+FORMAT_ALIASES = {"jpg": "jpeg"}
+LOSSY_FORMATS = {"jpeg", "webp"}
+TREND_TEMPLATE_LIMIT = 4
+
+
+def normalize_format(fmt: str) -> str:
+    fmt = fmt.lower()
+    return FORMAT_ALIASES.get(fmt, fmt)
+
+
+def file_extension(fmt: str) -> str:
+    fmt = normalize_format(fmt)
+    return "jpg" if fmt == "jpeg" else fmt
+
+
+class DailyChartTemplate:
+    def __init__(self):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.fig = Figure(figsize=(9, 10))
+        FigureCanvasAgg(self.fig)
+        self.axes = self.fig.subplots(2, 1)
+
+        self.water_bars = self.axes[0].bar(["actual", "target"], [0, 0])
+        self.axes[0].set_title("Daily water balance (ml)")
+
+        self.calorie_bars = self.axes[1].bar(["net", "target"], [0, 0])
+        self.axes[1].set_title("Daily calorie balance (kcal)")
+
+        for ax in self.axes:
+            ax.grid(axis="y", alpha=0.4)
+            ax.spines["top"].set_visible(False)
+            ax.spines["right"].set_visible(False)
+
+        self.fig.subplots_adjust(left=0.12, right=0.97, top=0.95, bottom=0.05, hspace=0.25)
+
+    @staticmethod
+    def _update(ax, bars, heights) -> None:
+        for bar, height in zip(bars, heights):
+            bar.set_height(height)
+
+        low = min(0, *heights)
+        high = max(0, *heights)
+        if low == high:
+            high = 1
+        margin = (high - low) * 0.05
+        ax.set_ylim(low - margin if low < 0 else 0, high + margin)
+
+    def render(
+        self,
+        water_actual: float,
+        water_target: float,
+        calorie_net: float,
+        calorie_target: float,
+        dpi: int,
+        fmt: str,
+        quality: Optional[int],
+    ) -> bytes:
+        self._update(self.axes[0], self.water_bars, [water_actual, water_target])
+        self._update(self.axes[1], self.calorie_bars, [calorie_net, calorie_target])
+        return save_figure(self.fig, dpi, fmt, quality)
+
+
+def save_figure(fig, dpi: int, fmt: str, quality: Optional[int]) -> bytes:
+    fmt = normalize_format(fmt)
+    options = {}
+    if fmt in LOSSY_FORMATS and quality is not None:
+        options["pil_kwargs"] = {"quality": quality}
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, dpi=dpi, **options)
+    return buffer.getvalue()
+
+
+def trend_series(last_ordinal: int, days: int, ordinals: bytes, *cumulative: bytes) -> List:
+    import numpy as np
+
+    known = np.frombuffer(ordinals, dtype=np.intc)
+    window = np.arange(last_ordinal - days, last_ordinal + 1)
+    rows = np.searchsorted(known, window, side="right") - 1
+
+    series = []
+    for column in cumulative:
+        values = np.concatenate(([0.0], np.frombuffer(column, dtype=np.float64)))
+        series.append(np.diff(values[rows + 1]))
+    return series
+
+
+def moving_average(values, size: int):
+    import numpy as np
+
+    sums = np.cumsum(np.concatenate(([0.0], values)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - size, 0)
+    return (sums[ends] - sums[starts]) / (ends - starts)
+
+
+class TrendChartTemplate:
+    TITLES = (
+        "Water (ml/day)",
+        "Calories consumed (kcal/day)",
+        "Calories burned (kcal/day)",
+    )
+
+    def __init__(self, days: int):
+        import numpy as np
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.days = days
+        self.fig = Figure(figsize=(9, 10))
+        FigureCanvasAgg(self.fig)
+        self.axes = self.fig.subplots(3, 1, sharex=True)
+
+        positions = np.arange(days, dtype=np.float64)
+        width = 0.7 * 470 / days
+        self.segments = []
+        self.bars = []
+        self.averages = []
+        self.goals = []
+        for ax, title in zip(self.axes, self.TITLES):
+            segments = np.zeros((days, 2, 2))
+            segments[:, :, 0] = positions[:, None]
+            self.segments.append(segments)
+            self.bars.append(ax.vlines(positions, 0, [0] * days, linewidth=width, alpha=0.6))
+            self.averages.append(ax.plot(positions, [0] * days, color="tab:red", linewidth=2)[0])
+            self.goals.append(ax.axhline(0, color="tab:green", linestyle="--", linewidth=1.5))
+            ax.set_title(title)
+            ax.grid(axis="y", alpha=0.4)
+            ax.spines["top"].set_visible(False)
+            ax.spines["right"].set_visible(False)
+
+        step = max(1, days // 8)
+        self.ticks = list(range(days - 1, -1, -step))[::-1]
+        self.axes[-1].set_xticks(self.ticks)
+        self.axes[-1].set_xlim(-0.6, days - 0.4)
+
+        self.fig.subplots_adjust(left=0.12, right=0.97, top=0.95, bottom=0.06, hspace=0.3)
+
+    def render(
+        self,
+        last_ordinal: int,
+        series,
+        goals: Tuple[Optional[float], ...],
+        average_size: int,
+        dpi: int,
+        fmt: str,
+        quality: Optional[int],
+    ) -> bytes:
+        for ax, segments, bars, average, goal_line, values, goal in zip(
+            self.axes, self.segments, self.bars, self.averages, self.goals, series, goals
+        ):
+            segments[:, 1, 1] = values
+            bars.set_segments(segments)
+            average.set_ydata(moving_average(values, average_size))
+
+            goal_line.set_visible(bool(goal))
+            goal_line.set_ydata([goal or 0, goal or 0])
+
+            high = max(float(values.max()), goal or 0)
+            ax.set_ylim(0, high * 1.1 if high > 0 else 1)
+
+        first = last_ordinal - self.days + 1
+        self.axes[-1].set_xticklabels(
+            [date.fromordinal(first + tick).strftime("%d.%m") for tick in self.ticks]
+        )
+        return save_figure(self.fig, dpi, fmt, quality)
+
+
+_daily_template: Optional[DailyChartTemplate] = None
+_trend_templates: "OrderedDict[int, TrendChartTemplate]" = OrderedDict()
+
+
+def _get_daily_template() -> DailyChartTemplate:
+    global _daily_template
+    if _daily_template is None:
+        _daily_template = DailyChartTemplate()
+    return _daily_template
+
+
+def warm_up() -> int:
+    _get_daily_template()
+    return os.getpid()
+
+
+def render_daily_charts(
+    water_actual: float,
+    water_target: float,
+    calorie_net: float,
+    calorie_target: float,
+    dpi: int = 250,
+    fmt: str = "png",
+    quality: Optional[int] = None,
+) -> bytes:
+    return _get_daily_template().render(
+        water_actual, water_target, calorie_net, calorie_target, dpi, fmt, quality
+    )
+
+
+def render_trend_charts(
+    last_ordinal: int,
+    days: int,
+    ordinals: bytes,
+    water: bytes,
+    calories: bytes,
+    burned: bytes,
+    water_goal: Optional[float],
+    calorie_goal: Optional[float],
+    average_size: int = 7,
+    dpi: int = 250,
+    fmt: str = "png",
+    quality: Optional[int] = None,
+) -> bytes:
+    template = _trend_templates.get(days)
+    if template is None:
+        template = _trend_templates[days] = TrendChartTemplate(days)
+        while len(_trend_templates) > TREND_TEMPLATE_LIMIT:
+            _trend_templates.popitem(last=False)
+    _trend_templates.move_to_end(days)
+
+    series = trend_series(last_ordinal, days, ordinals, water, calories, burned)
+    return template.render(
+        last_ordinal, series, (water_goal, calorie_goal, None), average_size, dpi, fmt, quality
+    )
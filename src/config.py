@@ -1,55 +1,390 @@
 from dotenv import load_dotenv
+from dataclasses import dataclass
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Callable, FrozenSet, List, Optional, Tuple
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
 
 
 load_dotenv()
 
 
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-WEATHER_API_KEY = os.getenv("WEATHER_API_KEY")
-LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+STORAGE_BACKENDS = ("memory", "sqlite", "redis")
+FSM_STORAGES = ("memory", "redis")
+BOT_MODES = ("polling", "webhook")
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+LOG_FORMATS = ("text", "json")
+CHART_FORMATS = ("png", "webp", "jpeg", "jpg")
 
+HISTORY_MAX_DAYS = 30
 
-CONSUMER_KEY = os.getenv("CONSUMER_KEY")
-CONSUMER_SECRET = os.getenv("CONSUMER_SECRET")
 
-def create_logger(name: str, level: str) -> logging.Logger:
+class EnvReader:
+    def __init__(self):
+        self.errors: List[str] = []
+
+    def text(self, name: str, default: str = "") -> str:
+        return os.getenv(name, default)
+
+    def choice(self, name: str, default: str, choices: Tuple[str, ...]) -> str:
+        value = os.getenv(name, default).strip()
+        for option in choices:
+            if option.lower() == value.lower():
+                return option
+        self.errors.append(f"{name} must be one of {', '.join(choices)}, got {value!r}")
+        return default
+
+    def _parse(self, name: str, default: Any, kind: Callable[[str], Any], minimum: Any, maximum: Any) -> Any:
+        raw = os.getenv(name)
+        if raw is None or not raw.strip():
+            return default
+
+        try:
+            value = kind(raw.strip())
+        except ValueError:
+            self.errors.append(f"{name} must be a number, got {raw!r}")
+            return default
+
+        if value < minimum or (maximum is not None and value > maximum):
+            limit = f"between {minimum} and {maximum}" if maximum is not None else f"at least {minimum}"
+            self.errors.append(f"{name} must be {limit}, got {raw!r}")
+            return default
+        return value
+
+    def integer(self, name: str, default: int, minimum: int = 0, maximum: Optional[int] = None) -> int:
+        return self._parse(name, default, int, minimum, maximum)
+
+    def number(self, name: str, default: float, minimum: float = 0, maximum: Optional[float] = None) -> float:
+        return self._parse(name, default, float, minimum, maximum)
+
+    def ids(self, name: str) -> FrozenSet[int]:
+        values = [value.strip() for value in os.getenv(name, "").split(",") if value.strip()]
+        try:
+            return frozenset(int(value) for value in values)
+        except ValueError:
+            self.errors.append(f"{name} must be a comma-separated list of Telegram ids")
+            return frozenset()
+
+
+@dataclass(frozen=True)
+class Settings:
+    bot_token: Optional[str]
+    weather_api_key: Optional[str]
+    consumer_key: Optional[str]
+    consumer_secret: Optional[str]
+    log_level: str
+    log_format: str
+    log_message_sample_rate: float
+
+    http_pool_limit: int
+    http_pool_limit_per_host: int
+    http_keepalive_timeout: float
+    http_dns_cache_ttl: int
+    http_total_timeout: float
+    http_connect_timeout: float
+
+    circuit_failure_threshold: int
+    circuit_reset_timeout: float
+    hedge_min_delay: float
+    hedge_min_samples: int
+    weather_deadline: float
+    openfoodfacts_deadline: float
+
+    weather_api_url: str
+    openfoodfacts_api_url: str
+
+    weather_cache_ttl: float
+    weather_cache_size: int
+    weather_refresh_interval: float
+    weather_refresh_concurrency: int
+
+    fatsecret_max_workers: int
+    fatsecret_timeout: float
+
+    nutrition_cache_path: str
+    nutrition_cache_size: int
+    nutrition_cache_ttl: float
+    nutrition_negative_ttl: float
+
+    food_lookup_deadline: float
+    food_provider_stagger: float
+
+    chart_workers: int
+    chart_max_pending: int
+    chart_queue_timeout: float
+    chart_dpi: int
+    chart_format: str
+    chart_quality: int
+    chart_cache_size: int
+    chart_cache_ttl: float
+    chart_trend_max_days: int
+    chart_trend_average: int
+
+    prewarm_delay: float
+
+    retention_days: int
+    retention_interval: float
+    retention_spill_dir: str
+
+    storage_backend: str
+    storage_path: str
+    storage_flush_interval: float
+    storage_max_resident: int
+    user_lock_shards: int
+
+    admin_ids: FrozenSet[int]
+    export_dir: str
+    export_batch_size: int
+
+    fsm_storage: str
+    fsm_state_ttl: int
+    fsm_data_ttl: int
+
+    redis_url: str
+    redis_key_prefix: str
+    redis_profile_ttl: int
+
+    sender_global_rate: float
+    sender_chat_rate: float
+    sender_chat_burst: float
+    sender_max_queue: int
+    sender_workers: int
+    sender_max_retries: int
+
+    bot_mode: str
+    webhook_base_url: str
+    webhook_path: str
+    webhook_secret: str
+    webhook_host: str
+    webhook_port: int
+    webhook_health_path: str
+    webhook_shutdown_timeout: float
+
+    metrics_host: str
+    metrics_port: int
+
+    watchdog_threshold: float
+    watchdog_interval: float
+    watchdog_stack_depth: int
+
+    parse_errors: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        env = EnvReader()
+        cpu_count = os.cpu_count() or 1
+
+        values = dict(
+            bot_token=os.getenv("BOT_TOKEN"),
+            weather_api_key=os.getenv("WEATHER_API_KEY"),
+            consumer_key=os.getenv("CONSUMER_KEY"),
+            consumer_secret=os.getenv("CONSUMER_SECRET"),
+            log_level=env.choice("LOG_LEVEL", "INFO", LOG_LEVELS),
+            log_format=env.choice("LOG_FORMAT", "text", LOG_FORMATS),
+            log_message_sample_rate=env.number("LOG_MESSAGE_SAMPLE_RATE", 1, maximum=1),
+
+            http_pool_limit=env.integer("HTTP_POOL_LIMIT", 100),
+            http_pool_limit_per_host=env.integer("HTTP_POOL_LIMIT_PER_HOST", 20),
+            http_keepalive_timeout=env.number("HTTP_KEEPALIVE_TIMEOUT", 30),
+            http_dns_cache_ttl=env.integer("HTTP_DNS_CACHE_TTL", 300),
+            http_total_timeout=env.number("HTTP_TOTAL_TIMEOUT", 10, minimum=0.1),
+            http_connect_timeout=env.number("HTTP_CONNECT_TIMEOUT", 3, minimum=0.1),
+
+            circuit_failure_threshold=env.integer("CIRCUIT_FAILURE_THRESHOLD", 5, minimum=1),
+            circuit_reset_timeout=env.number("CIRCUIT_RESET_TIMEOUT", 30),
+            hedge_min_delay=env.number("HEDGE_MIN_DELAY", 0.2),
+            hedge_min_samples=env.integer("HEDGE_MIN_SAMPLES", 20, minimum=1),
+            weather_deadline=env.number("WEATHER_DEADLINE", 3, minimum=0.1),
+            openfoodfacts_deadline=env.number("OPENFOODFACTS_DEADLINE", 4, minimum=0.1),
+
+            weather_api_url=env.text("WEATHER_API_URL", "http://api.openweathermap.org/data/2.5/weather"),
+            openfoodfacts_api_url=env.text("OPENFOODFACTS_API_URL", "https://world.openfoodfacts.org/cgi/search.pl"),
+
+            weather_cache_ttl=env.number("WEATHER_CACHE_TTL", 600),
+            weather_cache_size=env.integer("WEATHER_CACHE_SIZE", 1024, minimum=1),
+            weather_refresh_interval=env.number("WEATHER_REFRESH_INTERVAL", 300),
+            weather_refresh_concurrency=env.integer("WEATHER_REFRESH_CONCURRENCY", 10, minimum=1),
+
+            fatsecret_max_workers=env.integer("FATSECRET_MAX_WORKERS", 4, minimum=1),
+            fatsecret_timeout=env.number("FATSECRET_TIMEOUT", 8, minimum=0.1),
+
+            nutrition_cache_path=env.text("NUTRITION_CACHE_PATH", "nutrition_cache.sqlite3"),
+            nutrition_cache_size=env.integer("NUTRITION_CACHE_SIZE", 5000, minimum=1),
+            nutrition_cache_ttl=env.number("NUTRITION_CACHE_TTL", 30 * 24 * 3600),
+            nutrition_negative_ttl=env.number("NUTRITION_NEGATIVE_TTL", 600),
+
+            food_lookup_deadline=env.number("FOOD_LOOKUP_DEADLINE", 6, minimum=0.1),
+            food_provider_stagger=env.number("FOOD_PROVIDER_STAGGER", 0.5),
+
+            chart_workers=env.integer("CHART_WORKERS", cpu_count, minimum=1),
+            chart_max_pending=env.integer("CHART_MAX_PENDING", 4 * cpu_count, minimum=1),
+            chart_queue_timeout=env.number("CHART_QUEUE_TIMEOUT", 5),
+            chart_dpi=env.integer("CHART_DPI", 120, minimum=10, maximum=600),
+            chart_format=env.choice("CHART_FORMAT", "png", CHART_FORMATS),
+            chart_quality=env.integer("CHART_QUALITY", 85, minimum=1, maximum=100),
+            chart_cache_size=env.integer("CHART_CACHE_SIZE", 1024, minimum=1),
+            chart_cache_ttl=env.number("CHART_CACHE_TTL", 3600),
+            chart_trend_max_days=env.integer("CHART_TREND_MAX_DAYS", 90, minimum=2),
+            chart_trend_average=env.integer("CHART_TREND_AVERAGE", 7, minimum=1),
+
+            prewarm_delay=env.number("PREWARM_DELAY", 2),
+
+            retention_days=env.integer("RETENTION_DAYS", 0),
+            retention_interval=env.number("RETENTION_INTERVAL", 3600),
+            retention_spill_dir=env.text("RETENTION_SPILL_DIR"),
+
+            storage_backend=env.choice("STORAGE_BACKEND", "memory", STORAGE_BACKENDS),
+            storage_path=env.text("STORAGE_PATH", "users.sqlite3"),
+            storage_flush_interval=env.number("STORAGE_FLUSH_INTERVAL", 2, minimum=0.01),
+            storage_max_resident=env.integer("STORAGE_MAX_RESIDENT", 10000, minimum=1),
+            user_lock_shards=env.integer("USER_LOCK_SHARDS", 4096),
+
+            admin_ids=env.ids("ADMIN_IDS"),
+            export_dir=env.text("EXPORT_DIR", "exports"),
+            export_batch_size=env.integer("EXPORT_BATCH_SIZE", 500, minimum=1),
+
+            fsm_storage=env.choice("FSM_STORAGE", "memory", FSM_STORAGES),
+            fsm_state_ttl=env.integer("FSM_STATE_TTL", 24 * 3600),
+            fsm_data_ttl=env.integer("FSM_DATA_TTL", 24 * 3600),
+
+            redis_url=env.text("REDIS_URL", "redis://localhost:6379/0"),
+            redis_key_prefix=env.text("REDIS_KEY_PREFIX", "fitness_bot"),
+            redis_profile_ttl=env.integer("REDIS_PROFILE_TTL", 0),
+
+            sender_global_rate=env.number("SENDER_GLOBAL_RATE", 30, minimum=0.01),
+            sender_chat_rate=env.number("SENDER_CHAT_RATE", 1, minimum=0.01),
+            sender_chat_burst=env.number("SENDER_CHAT_BURST", 3, minimum=1),
+            sender_max_queue=env.integer("SENDER_MAX_QUEUE", 10000, minimum=1),
+            sender_workers=env.integer("SENDER_WORKERS", 16, minimum=1),
+            sender_max_retries=env.integer("SENDER_MAX_RETRIES", 3),
+
+            bot_mode=env.choice("BOT_MODE", "polling", BOT_MODES),
+            webhook_base_url=env.text("WEBHOOK_BASE_URL"),
+            webhook_path=env.text("WEBHOOK_PATH", "/webhook"),
+            webhook_secret=env.text("WEBHOOK_SECRET"),
+            webhook_host=env.text("WEBHOOK_HOST", "0.0.0.0"),
+            webhook_port=env.integer("WEBHOOK_PORT", 8080, minimum=1, maximum=65535),
+            webhook_health_path=env.text("WEBHOOK_HEALTH_PATH", "/health"),
+            webhook_shutdown_timeout=env.number("WEBHOOK_SHUTDOWN_TIMEOUT", 10),
+
+            metrics_host=env.text("METRICS_HOST", "127.0.0.1"),
+            metrics_port=env.integer("METRICS_PORT", 0, maximum=65535),
+
+            watchdog_threshold=env.number("WATCHDOG_THRESHOLD", 0),
+            watchdog_interval=env.number("WATCHDOG_INTERVAL", 0.05, minimum=0.001),
+            watchdog_stack_depth=env.integer("WATCHDOG_STACK_DEPTH", 30, minimum=1),
+        )
+        return cls(**values, parse_errors=tuple(env.errors))
+
+    def errors(self) -> List[str]:
+        errors = list(self.parse_errors)
+
+        required = {
+            "BOT_TOKEN": self.bot_token,
+            "WEATHER_API_KEY": self.weather_api_key,
+            "CONSUMER_KEY": self.consumer_key,
+            "CONSUMER_SECRET": self.consumer_secret,
+        }
+        missing = [name for name, value in required.items() if not value]
+        if missing:
+            errors.append("Missing environment variables: " + ", ".join(missing))
+
+        if self.bot_mode == "webhook" and not self.webhook_base_url:
+            errors.append("WEBHOOK_BASE_URL is required in webhook mode")
+        if self.bot_mode == "webhook" and not self.webhook_secret:
+            errors.append("WEBHOOK_SECRET is required in webhook mode")
+        if 0 < self.retention_days < HISTORY_MAX_DAYS:
+            errors.append(f"RETENTION_DAYS must be 0 or at least {HISTORY_MAX_DAYS}")
+        if self.retention_days and not self.retention_spill_dir:
+            errors.append("RETENTION_SPILL_DIR is required when RETENTION_DAYS is set")
+
+        return errors
+
+    def validate(self) -> None:
+        errors = self.errors()
+        for error in errors:
+            logger.error(error)
+        if errors:
+            raise RuntimeError("Environment configuration error")
+
+
+settings = Settings.from_env()
+
+
+LOG_CONTEXT_FIELDS = ("user_id", "command", "state", "handler", "update_type", "duration_ms")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in LOG_CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+_log_listeners = []
+
+
+def create_logger(name: str, level: str, fmt: Optional[str] = None) -> logging.Logger:
     log = logging.getLogger(name)
     log.setLevel(level)
 
     if not log.handlers:
         handler = logging.StreamHandler()
-        handler.setFormatter(
-            logging.Formatter(
-                fmt="%(asctime)s | %(levelname)s | %(message)s"
+        if (fmt or settings.log_format) == "json":
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(
+                logging.Formatter(
+                    fmt="%(asctime)s | %(levelname)s | %(message)s"
+                )
             )
-        )
-        log.addHandler(handler)
 
-    return log
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, handler, respect_handler_level=True)
+        listener.start()
+        _log_listeners.append(listener)
 
-logger = create_logger("fitness_bot", LOG_LEVEL)
+        log.addHandler(DeferredQueueHandler(log_queue))
+
+    return log
 
-REQUIRED_ENV_VARS = {
-    "BOT_TOKEN": BOT_TOKEN,
-    "WEATHER_API_KEY": WEATHER_API_KEY,
-    "CONSUMER_KEY": CONSUMER_KEY,
-    "CONSUMER_SECRET": CONSUMER_SECRET,
-}
 
-missing = [name for name, value in REQUIRED_ENV_VARS.items() if not value]
+def stop_logging() -> None:
+    while _log_listeners:
+        _log_listeners.pop().stop()
 
-if missing:
-    logger.error("Missing environment variables: %s", ", ".join(missing))
-    raise RuntimeError("Environment configuration error")
 
+atexit.register(stop_logging)
 
+logger = create_logger("fitness_bot", settings.log_level)
 
 WATER_PER_KG = 35
 WATER_PER_ACTIVITY = 400
 WATER_PER_WORKOUT = 250
 WATER_HOT_WEATHER = 350 
+DEFAULT_TEMPERATURE = 20
 
 
 WORKOUT_CALORIES = {
@@ -0,0 +1,173 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from cache import NutritionCache
+from config import logger
+from metrics import observe_external
+from utils import lookup_food_fatsecret, lookup_food_openfacts
+
+
+class FoodProvider:
+    name = "provider"
+
+    async def lookup(self, query: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+
+class FatSecretProvider(FoodProvider):
+    name = "fatsecret"
+
+    async def lookup(self, query: str) -> Optional[Dict]:
+        return await lookup_food_fatsecret(query)
+
+
+class OpenFoodFactsProvider(FoodProvider):
+    name = "openfoodfacts"
+
+    async def lookup(self, query: str) -> Optional[Dict]:
+        return await lookup_food_openfacts(query)
+
+
+class ProviderStats:
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.calls = 0
+        self.errors = 0
+        self.wins = 0
+        self.latency = 0.0
+        self.error_rate = 0.0
+
+    def observe(self, elapsed: float, failed: bool) -> None:
+        self.calls += 1
+        self.errors += int(failed)
+
+        if self.calls == 1:
+            self.latency = elapsed
+            self.error_rate = float(failed)
+            return
+
+        self.latency += self.alpha * (elapsed - self.latency)
+        self.error_rate += self.alpha * (float(failed) - self.error_rate)
+
+    def observe_cancelled(self, elapsed: float) -> None:
+        if elapsed > self.latency:
+            self.latency += self.alpha * (elapsed - self.latency)
+
+    def score(self) -> float:
+        return self.latency * (1 + 4 * self.error_rate)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "wins": self.wins,
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+        }
+
+
+def is_valid_food(result: Optional[Dict]) -> bool:
+    return bool(result) and not result.get("error") and "calories" in result
+
+
+class FoodResolver:
+    def __init__(
+        self,
+        providers: List[FoodProvider],
+        deadline: float,
+        cache: Optional[NutritionCache] = None,
+        stagger: float = 0.0,
+    ):
+        self.providers = providers
+        self.deadline = deadline
+        self.cache = cache
+        self.stagger = stagger
+        self.stats: Dict[str, ProviderStats] = {p.name: ProviderStats() for p in providers}
+
+    def ranked_providers(self) -> List[FoodProvider]:
+        for provider in self.providers:
+            self.stats.setdefault(provider.name, ProviderStats())
+        return sorted(self.providers, key=lambda p: self.stats[p.name].score())
+
+    async def _run(
+        self, provider: FoodProvider, query: str, delay: float, fallback: asyncio.Event
+    ) -> Optional[Dict]:
+        if delay:
+            try:
+                await asyncio.wait_for(fallback.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+        stats = self.stats[provider.name]
+        started = time.perf_counter()
+
+        try:
+            result = await provider.lookup(query)
+        except asyncio.CancelledError:
+            stats.observe_cancelled(time.perf_counter() - started)
+            raise
+        except Exception as exc:
+            stats.observe(time.perf_counter() - started, failed=True)
+            logger.error("Food provider %s error: %s", provider.name, exc)
+            return {"error": str(exc), "name": query}
+
+        failed = bool(result) and bool(result.get("error"))
+        stats.observe(time.perf_counter() - started, failed=failed)
+        return result
+
+    @observe_external("food_resolver")
+    async def resolve(self, query: str) -> Optional[Dict]:
+        if self.cache is not None:
+            found, cached = await self.cache.get(query)
+            if found:
+                return cached
+
+        ranked = self.ranked_providers()
+        fallback = asyncio.Event()
+        tasks = {
+            asyncio.ensure_future(self._run(provider, query, self.stagger * position, fallback)): provider
+            for position, provider in enumerate(ranked)
+        }
+        order = {provider.name: position for position, provider in enumerate(ranked)}
+
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + self.deadline
+        pending = set(tasks)
+        winner: Optional[Dict] = None
+        first_error: Optional[Dict] = None
+
+        try:
+            while pending and winner is None:
+                remaining = deadline_at - loop.time()
+                if remaining <= 0:
+                    break
+
+                done, pending = await asyncio.wait(
+                    pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for task in sorted(done, key=lambda t: order[tasks[t].name]):
+                    result = task.result()
+                    if is_valid_food(result):
+                        winner = result
+                        self.stats[tasks[task].name].wins += 1
+                        break
+                    fallback.set()
+                    if result and first_error is None:
+                        first_error = result
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if winner is None and pending:
+            logger.error("Food lookup deadline exceeded: %s", query)
+            return first_error or {"error": "timeout", "name": query}
+
+        if self.cache is not None and (winner is not None or first_error is None):
+            self.cache.put(query, winner)
+
+        return winner or first_error
+
+    def provider_stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
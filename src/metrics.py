@@ -0,0 +1,272 @@
+import functools
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+from config import logger
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_io_wait: ContextVar[Optional[List[float]]] = ContextVar("io_wait", default=None)
+_in_external: ContextVar[bool] = ContextVar("in_external", default=False)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float) -> None:
+        self.values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class CallbackGauge(Metric):
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        collect: Callable[[], Dict[Tuple[str, ...], float]],
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        try:
+            values = self.collect()
+        except Exception as exc:
+            logger.error("Ошибка при сборе метрики %s: %s", self.name, exc)
+            values = {}
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in values.items()
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.counts: Dict[Tuple[str, ...], List[int]] = {}
+        self.sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, *labels: str, value: float) -> None:
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, counts in self.counts.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                label_text = _format_labels(self.labelnames, labels, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{label_text} {total}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {self.sums[labels]}")
+            lines.append(f"{self.name}_count{label_text} {total}")
+        return lines
+
+
+registry: List[Metric] = []
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Wall time spent in an aiogram handler", ["handler"]
+)
+HANDLER_IO_WAIT_SECONDS = Histogram(
+    "bot_handler_io_wait_seconds", "Time a handler spent awaiting external calls", ["handler"]
+)
+HANDLER_COMPUTE_SECONDS = Histogram(
+    "bot_handler_compute_seconds", "Handler wall time minus external call time", ["handler"]
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Exceptions raised by aiogram handlers", ["handler"]
+)
+HANDLER_IN_FLIGHT = Gauge(
+    "bot_handler_in_flight", "Handlers currently running", ["handler"]
+)
+
+EXTERNAL_SECONDS = Histogram(
+    "bot_external_seconds", "Latency of external API calls", ["api"]
+)
+EXTERNAL_ERRORS = Counter(
+    "bot_external_errors_total", "Failed external API calls", ["api"]
+)
+EXTERNAL_IN_FLIGHT = Gauge(
+    "bot_external_in_flight", "External API calls in progress", ["api"]
+)
+
+
+def _is_error(result) -> bool:
+    return isinstance(result, dict) and bool(result.get("error"))
+
+
+def observe_external(api: str):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            nested = _in_external.get()
+            token = _in_external.set(True)
+            EXTERNAL_IN_FLIGHT.inc(api)
+            started = time.perf_counter()
+            failed = True
+
+            try:
+                result = await func(*args, **kwargs)
+                failed = _is_error(result)
+                return result
+            finally:
+                elapsed = time.perf_counter() - started
+                EXTERNAL_IN_FLIGHT.dec(api)
+                EXTERNAL_SECONDS.observe(api, value=elapsed)
+                if failed:
+                    EXTERNAL_ERRORS.inc(api)
+
+                _in_external.reset(token)
+                wait = _io_wait.get()
+                if wait is not None and not nested:
+                    wait[0] += elapsed
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data: dict):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+
+        wait = [0.0]
+        token = _io_wait.set(wait)
+        HANDLER_IN_FLIGHT.inc(name)
+        started = time.perf_counter()
+
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_IN_FLIGHT.dec(name)
+            HANDLER_SECONDS.observe(name, value=elapsed)
+            HANDLER_IO_WAIT_SECONDS.observe(name, value=wait[0])
+            HANDLER_COMPUTE_SECONDS.observe(name, value=max(0.0, elapsed - wait[0]))
+            _io_wait.reset(token)
+
+
+def register_stats(
+    prefix: str,
+    documentation: str,
+    label: str,
+    sources: Dict[str, Callable[[], Dict[str, float]]],
+    keys: Sequence[str],
+) -> None:
+    def collector(key: str):
+        def collect() -> Dict[Tuple[str, ...], float]:
+            values = {}
+            for name, stats in sources.items():
+                value = stats().get(key)
+                if value is not None:
+                    values[(name,)] = value
+            return values
+        return collect
+
+    for key in keys:
+        CallbackGauge(f"{prefix}_{key}", f"{documentation}: {key}", [label], collector(key))
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(
+        text=render_metrics(),
+        content_type="text/plain",
+        headers={"X-Content-Type-Options": "nosniff"},
+    )
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на %s:%s/metrics", host, port)
+    return runner
@@ -1,11 +1,61 @@
+import asyncio
+import base64
+import sys
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass, field, asdict
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Union
+from config import WATER_PER_KG, WATER_PER_ACTIVITY, WATER_HOT_WEATHER, DEFAULT_TEMPERATURE
 
-from dataclasses import dataclass, field
-from datetime import datetime
-from typing import Dict, List
-from config import WATER_PER_KG, WATER_PER_ACTIVITY, WATER_HOT_WEATHER
 
+_background_tasks: Set[asyncio.Task] = set()
 
-@dataclass
+ProfileUpdate = Callable[[int, Callable[["UserProfile"], Awaitable[bool]]], Awaitable[bool]]
+
+
+def to_epoch(value: Union[int, float, str]) -> int:
+    if isinstance(value, str):
+        return int(datetime.fromisoformat(value).timestamp())
+    return int(value)
+
+
+class LogEntry:
+    __slots__ = ()
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def time(self) -> datetime:
+        return datetime.fromtimestamp(self.timestamp)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]):
+        data = dict(data)
+        data["timestamp"] = to_epoch(data["timestamp"])
+        return cls(**data)
+
+
+@dataclass(slots=True)
+class FoodEntry(LogEntry):
+    name: str
+    weight: float
+    calories: float
+    timestamp: int
+
+
+@dataclass(slots=True)
+class WorkoutEntry(LogEntry):
+    type: str
+    duration: int
+    calories: float
+    timestamp: int
+
+
+@dataclass(slots=True)
 class DayRecord:
     date: str
     logged_water: float = 0
@@ -13,12 +63,148 @@ class DayRecord:
     burned_calories: float = 0
     water_goal: float = 0
     calorie_goal: float = 0
-    temperature: float = 0
-    food_log: List[Dict] = field(default_factory=list)
-    workout_log: List[Dict] = field(default_factory=list)
+    temperature: Optional[float] = None
+    food_log: List[FoodEntry] = field(default_factory=list)
+    workout_log: List[WorkoutEntry] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DayRecord":
+        data = dict(data)
+        food_log = data.pop("food_log", [])
+        workout_log = data.pop("workout_log", [])
+
+        record = cls(**data)
+        record.food_log = [FoodEntry.from_dict(entry) for entry in food_log]
+        record.workout_log = [WorkoutEntry.from_dict(entry) for entry in workout_log]
+        return record
+
+
+def _pack(values: array) -> str:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode("ascii")
+
+
+def _unpack(typecode: str, data: str) -> array:
+    values = array(typecode, base64.b64decode(data))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def date_ordinal(day: str) -> int:
+    return date.fromisoformat(day).toordinal()
+
+
+class DailyAggregates:
+    __slots__ = ("ordinals", "water", "calories", "burned", "minutes")
+
+    def __init__(self):
+        self.ordinals = array("i")
+        self.water = array("d")
+        self.calories = array("d")
+        self.burned = array("d")
+        self.minutes: Dict[str, array] = {}
+
+    def _columns(self) -> List[array]:
+        return [self.water, self.calories, self.burned, *self.minutes.values()]
+
+    def _row(self, ordinal: int) -> int:
+        size = len(self.ordinals)
+        if size and self.ordinals[-1] == ordinal:
+            return size - 1
 
+        position = bisect_right(self.ordinals, ordinal)
+        if position and self.ordinals[position - 1] == ordinal:
+            return position - 1
 
-@dataclass
+        self.ordinals.insert(position, ordinal)
+        for column in self._columns():
+            column.insert(position, column[position - 1] if position else 0.0)
+        return position
+
+    def add(
+        self,
+        day: str,
+        water: float = 0,
+        calories: float = 0,
+        burned: float = 0,
+        workout_type: Optional[str] = None,
+        minutes: float = 0,
+    ) -> None:
+        if workout_type is not None and workout_type not in self.minutes:
+            self.minutes[workout_type] = array("d", bytes(8 * len(self.ordinals)))
+
+        row = self._row(date_ordinal(day))
+        for position in range(row, len(self.ordinals)):
+            self.water[position] += water
+            self.calories[position] += calories
+            self.burned[position] += burned
+            if workout_type is not None:
+                self.minutes[workout_type][position] += minutes
+
+    def _cumulative(self, ordinal: int) -> int:
+        return bisect_right(self.ordinals, ordinal) - 1
+
+    def totals(self, first_day: date, last_day: date) -> Dict[str, Any]:
+        end = self._cumulative(last_day.toordinal())
+        start = self._cumulative(first_day.toordinal() - 1)
+
+        def window(column: array) -> float:
+            if end < 0:
+                return 0.0
+            return column[end] - (column[start] if start >= 0 else 0.0)
+
+        minutes = {kind: window(column) for kind, column in self.minutes.items()}
+        return {
+            "days": max(0, end - start),
+            "water": window(self.water),
+            "calories": window(self.calories),
+            "burned": window(self.burned),
+            "minutes": {kind: value for kind, value in minutes.items() if value},
+        }
+
+    def summary(self, through: int) -> Dict[str, Any]:
+        end = self._cumulative(through) + 1
+        return {
+            "through": through,
+            "ordinals": _pack(self.ordinals[:end]),
+            "water": _pack(self.water[:end]),
+            "calories": _pack(self.calories[:end]),
+            "burned": _pack(self.burned[:end]),
+            "minutes": {kind: _pack(column[:end]) for kind, column in self.minutes.items()},
+        }
+
+    @classmethod
+    def from_summary(cls, data: Dict[str, Any]) -> "DailyAggregates":
+        aggregates = cls()
+        aggregates.ordinals = _unpack("i", data["ordinals"])
+        aggregates.water = _unpack("d", data["water"])
+        aggregates.calories = _unpack("d", data["calories"])
+        aggregates.burned = _unpack("d", data["burned"])
+        aggregates.minutes = {kind: _unpack("d", column) for kind, column in data["minutes"].items()}
+        return aggregates
+
+    @classmethod
+    def from_records(
+        cls, records: Dict[str, DayRecord], aggregates: Optional["DailyAggregates"] = None
+    ) -> "DailyAggregates":
+        aggregates = aggregates if aggregates is not None else cls()
+        for key in sorted(records):
+            record = records[key]
+            aggregates.add(
+                key,
+                water=record.logged_water,
+                calories=record.logged_calories,
+                burned=record.burned_calories,
+            )
+            for entry in record.workout_log:
+                aggregates.add(key, workout_type=entry.type, minutes=entry.duration)
+        return aggregates
+
+
+@dataclass(slots=True)
 class UserProfile:
     user_id: int
     weight: float
@@ -27,28 +213,64 @@ class UserProfile:
     activity_minutes: int
     city: str
     daily_stats: Dict[str, DayRecord] = field(default_factory=dict)
+    aggregates: DailyAggregates = field(default_factory=DailyAggregates, repr=False, compare=False)
+    compacted_through: int = field(default=0, repr=False)
 
     def _today_key(self) -> str:
         return datetime.now().date().isoformat()
 
-    async def today(self) -> DayRecord:
-        
-
+    async def today(self, on_refresh: Optional["ProfileUpdate"] = None) -> DayRecord:
         key = self._today_key()
 
         if key not in self.daily_stats:
+            from utils import temperature_cache, city_cache_key
+
+            cache_key = city_cache_key(self.city)
+            temp = temperature_cache.peek(cache_key)
+            fresh = temp is not None
+            if not fresh:
+                temp = temperature_cache.peek(cache_key, allow_expired=True)
+            if temp is None:
+                temp = self._last_temperature()
+
             record = DayRecord(date=key)
             self.daily_stats[key] = record
+            self.recalculate_targets(temp)
 
-            from utils import fetch_city_temperature
-            from config import WEATHER_API_KEY
+            if not fresh:
+                task = asyncio.create_task(self._refresh_temperature(key, on_refresh))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
 
-            temp = await fetch_city_temperature(self.city, WEATHER_API_KEY)
-            temp = temp if temp is not None else 20
+        return self.daily_stats[key]
 
-            self.recalculate_targets(temp)
+    def _last_temperature(self) -> float:
+        for key in sorted(self.daily_stats, reverse=True):
+            temperature = self.daily_stats[key].temperature
+            if temperature is not None:
+                return temperature
+        return DEFAULT_TEMPERATURE
 
-        return self.daily_stats[key]
+    async def _refresh_temperature(self, key: str, on_refresh: Optional["ProfileUpdate"]) -> None:
+        from utils import fetch_city_temperature
+        from config import logger, settings
+
+        async def apply(profile: "UserProfile") -> bool:
+            if key != profile._today_key() or key not in profile.daily_stats:
+                return False
+            profile.recalculate_targets(temp)
+            return True
+
+        try:
+            temp = await fetch_city_temperature(self.city, settings.weather_api_key)
+            if temp is None:
+                return
+            if on_refresh is None:
+                await apply(self)
+            else:
+                await on_refresh(self.user_id, apply)
+        except Exception as exc:
+            logger.error("Не удалось обновить температуру для %s: %s", self.city, exc)
 
     def water_target(self, temperature: float) -> float:
         base = self.weight * WATER_PER_KG
@@ -61,6 +283,64 @@ class UserProfile:
         activity_bonus = self.activity_minutes * 4.2
         return base + activity_bonus
 
+    def log_water(self, record: DayRecord, amount: float) -> None:
+        record.logged_water += amount
+        self.aggregates.add(record.date, water=amount)
+
+    def log_food(self, record: DayRecord, entry: FoodEntry) -> None:
+        record.logged_calories += entry.calories
+        record.food_log.append(entry)
+        self.aggregates.add(record.date, calories=entry.calories)
+
+    def log_workout(self, record: DayRecord, entry: WorkoutEntry) -> None:
+        record.burned_calories += entry.calories
+        record.workout_log.append(entry)
+        self.aggregates.add(
+            record.date,
+            burned=entry.calories,
+            workout_type=entry.type,
+            minutes=entry.duration
+        )
+
+    def compact(self, before: date) -> List[DayRecord]:
+        cutoff = before.isoformat()
+        expired = sorted(key for key in self.daily_stats if key < cutoff)
+        if not expired:
+            return []
+
+        self.compacted_through = max(self.compacted_through, before.toordinal() - 1)
+        return [self.daily_stats.pop(key) for key in expired]
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "user_id": self.user_id,
+            "weight": self.weight,
+            "height": self.height,
+            "age": self.age,
+            "activity_minutes": self.activity_minutes,
+            "city": self.city,
+            "daily_stats": {key: asdict(record) for key, record in self.daily_stats.items()},
+        }
+        if self.compacted_through:
+            data["summary"] = self.aggregates.summary(self.compacted_through)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "UserProfile":
+        data = dict(data)
+        stats = data.pop("daily_stats", {})
+        summary = data.pop("summary", None)
+        profile = cls(**data)
+        profile.daily_stats = {key: DayRecord.from_dict(record) for key, record in stats.items()}
+        if summary:
+            profile.compacted_through = summary["through"]
+            profile.aggregates = DailyAggregates.from_records(
+                profile.daily_stats, DailyAggregates.from_summary(summary)
+            )
+        else:
+            profile.aggregates = DailyAggregates.from_records(profile.daily_stats)
+        return profile
+
     def recalculate_targets(self, temperature: float) -> None:
         record = self.daily_stats[self._today_key()]
         record.water_goal =  self.water_target(temperature)
@@ -0,0 +1,186 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+
+class CircuitOpen(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probing = False
+
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        self._probing = False
+
+
+class LatencyWindow:
+    def __init__(self, size: int = 200):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, value: float) -> None:
+        self.samples.append(value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class ResilientEndpoint:
+    def __init__(
+        self,
+        name: str,
+        deadline: float,
+        failure_threshold: int,
+        reset_timeout: float,
+        hedge: bool = True,
+        hedge_min_delay: float = 0.1,
+        hedge_min_samples: int = 20,
+    ):
+        self.name = name
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latency = LatencyWindow()
+
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.hedged = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge or len(self.latency.samples) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latency.percentile(95))
+
+    async def call(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        is_failure: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpen(f"{self.name} circuit is open")
+
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline_at = started + self.deadline
+
+        delay = self.hedge_delay()
+        hedge_at = started + delay if delay is not None else None
+        spare = self.hedge
+
+        attempts = {asyncio.ensure_future(factory())}
+        error: Optional[BaseException] = None
+        failed_result: Any = None
+
+        try:
+            while True:
+                if attempts:
+                    wake_at = deadline_at if hedge_at is None else min(deadline_at, hedge_at)
+                    done, attempts = await asyncio.wait(
+                        attempts,
+                        timeout=max(0.0, wake_at - loop.time()),
+                        return_when=asyncio.FIRST_COMPLETED
+                    )
+
+                    for task in done:
+                        if task.exception() is not None:
+                            error = task.exception()
+                            continue
+                        value = task.result()
+                        if is_failure is not None and is_failure(value):
+                            failed_result = value
+                            continue
+
+                        self.latency.add(loop.time() - started)
+                        self.breaker.record_success()
+                        return value
+
+                now = loop.time()
+                if now >= deadline_at:
+                    self.timeouts += 1
+                    error = asyncio.TimeoutError(f"{self.name} deadline exceeded")
+                    break
+
+                if spare and (not attempts or (hedge_at is not None and now >= hedge_at)):
+                    spare = False
+                    hedge_at = None
+                    self.hedged += 1
+                    attempts.add(asyncio.ensure_future(factory()))
+                elif not attempts:
+                    break
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        finally:
+            for task in attempts:
+                task.cancel()
+
+        self.failures += 1
+        self.breaker.record_failure()
+        if error is not None and failed_result is None:
+            raise error
+        return failed_result
+
+    def stats(self) -> Dict[str, float]:
+        p95 = self.latency.percentile(95)
+        return {
+            "state": {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}[self.breaker.state],
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "hedged": self.hedged,
+            "opened": self.breaker.opened,
+            "latency_p95": p95 if p95 is not None else 0.0,
+        }
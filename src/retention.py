@@ -0,0 +1,125 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+from dataclasses import asdict
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from config import logger
+from models import DayRecord, UserProfile
+from storage import UserRepository
+
+
+class RetentionCompactor:
+    def __init__(
+        self,
+        repository: UserRepository,
+        keep_days: int,
+        interval: float,
+        spill_dir: str = "",
+        batch_size: int = 500,
+    ):
+        self.repository = repository
+        self.keep_days = keep_days
+        self.interval = interval
+        self.spill_dir = spill_dir
+        self.batch_size = batch_size
+
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.compacted_profiles = 0
+        self.compacted_days = 0
+        self.spilled_days = 0
+        self.last_duration = 0.0
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.compact()
+            except Exception as exc:
+                logger.error("Ошибка сжатия старой истории: %s", exc)
+            await asyncio.sleep(self.interval)
+
+    def _spill_path(self) -> str:
+        return os.path.join(self.spill_dir, f"days-{date.today():%Y%m%d}.ndjson.gz")
+
+    @staticmethod
+    def _open_spill(path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return gzip.open(path, "at", encoding="utf-8")
+
+    @staticmethod
+    def _spill(file, user_id: int, records: List[DayRecord]) -> None:
+        file.writelines(
+            json.dumps({"user_id": user_id, **asdict(record)}, ensure_ascii=False) + "\n"
+            for record in records
+        )
+        file.flush()
+
+    async def compact(self) -> None:
+        started = time.monotonic()
+        before = date.today() - timedelta(days=self.keep_days - 1)
+        cutoff = before.isoformat()
+        stale = [
+            profile.user_id for profile in self.repository.resident()
+            if any(key < cutoff for key in profile.daily_stats)
+        ]
+
+        spill = None
+        if stale and self.spill_dir:
+            spill = await asyncio.to_thread(self._open_spill, self._spill_path())
+
+        compacted = 0
+        days = 0
+
+        async def apply(profile: UserProfile) -> bool:
+            nonlocal days
+            expired = [profile.daily_stats[key] for key in sorted(profile.daily_stats) if key < cutoff]
+            if not expired:
+                return False
+            if spill is not None:
+                await asyncio.to_thread(self._spill, spill, profile.user_id, expired)
+                self.spilled_days += len(expired)
+            days += len(profile.compact(before))
+            return True
+
+        try:
+            for index, user_id in enumerate(stale, 1):
+                if await self.repository.update(user_id, apply):
+                    compacted += 1
+                if index % self.batch_size == 0:
+                    await asyncio.sleep(0)
+        finally:
+            if spill is not None:
+                await asyncio.to_thread(spill.close)
+
+        self.runs += 1
+        self.compacted_profiles += compacted
+        self.compacted_days += days
+        self.last_duration = time.monotonic() - started
+        logger.debug("Сжато дней: %s у %s профилей", days, compacted)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "runs": self.runs,
+            "compacted_profiles": self.compacted_profiles,
+            "compacted_days": self.compacted_days,
+            "spilled_days": self.spilled_days,
+            "last_duration": self.last_duration,
+        }
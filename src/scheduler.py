@@ -0,0 +1,125 @@
+import asyncio
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Dict, List, Optional
+
+from config import logger
+from models import UserProfile
+from storage import UserRepository
+from utils import temperature_cache, city_cache_key, load_city_temperature
+
+
+class WeatherRefreshScheduler:
+    def __init__(self, repository: UserRepository, api_key: str, interval: float, concurrency: int):
+        self.repository = repository
+        self.api_key = api_key
+        self.interval = interval
+        self.concurrency = concurrency
+
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.cities = 0
+        self.failed = 0
+        self.updated_profiles = 0
+        self.last_duration = 0.0
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as exc:
+                logger.error("Ошибка фонового обновления погоды: %s", exc)
+            await asyncio.sleep(self.interval)
+
+    def _profiles_by_city(self) -> Dict[str, List[UserProfile]]:
+        cities: Dict[str, List[UserProfile]] = defaultdict(list)
+        for profile in self.repository.resident():
+            if profile.city:
+                cities[city_cache_key(profile.city)].append(profile)
+        return cities
+
+    async def _refresh_city(self, city: str, slots: asyncio.Semaphore) -> Optional[float]:
+        async with slots:
+            try:
+                return await temperature_cache.load(
+                    city_cache_key(city),
+                    lambda: load_city_temperature(city, self.api_key)
+                )
+            except Exception as exc:
+                logger.error("Не удалось обновить погоду для %s: %s", city, exc)
+                return None
+
+    @staticmethod
+    def _needs_update(profile: UserProfile, today: str, temperature: float) -> bool:
+        record = profile.daily_stats.get(today)
+        return record is not None and record.temperature != temperature
+
+    async def _update_profile(
+        self, user_id: int, today: str, temperature: float, slots: asyncio.Semaphore
+    ) -> bool:
+        async def apply(profile: UserProfile) -> bool:
+            if not self._needs_update(profile, today, temperature):
+                return False
+            profile.recalculate_targets(temperature)
+            return True
+
+        async with slots:
+            try:
+                return await self.repository.update(user_id, apply)
+            except Exception as exc:
+                logger.error("Не удалось пересчитать нормы пользователя %s: %s", user_id, exc)
+                return False
+
+    async def refresh(self) -> None:
+        started = time.monotonic()
+        cities = self._profiles_by_city()
+        slots = asyncio.Semaphore(self.concurrency)
+
+        keys = list(cities)
+        temperatures = await asyncio.gather(*(
+            self._refresh_city(cities[key][0].city, slots) for key in keys
+        ))
+
+        today = date.today().isoformat()
+        updates = []
+        for key, temperature in zip(keys, temperatures):
+            if temperature is None:
+                self.failed += 1
+                continue
+
+            for profile in cities[key]:
+                if self._needs_update(profile, today, temperature):
+                    updates.append(self._update_profile(profile.user_id, today, temperature, slots))
+        updated = sum(await asyncio.gather(*updates))
+
+        self.runs += 1
+        self.cities = len(keys)
+        self.updated_profiles += updated
+        self.last_duration = time.monotonic() - started
+        logger.debug(
+            "Погода обновлена для %s городов, пересчитано профилей: %s", len(keys), updated
+        )
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "runs": self.runs,
+            "cities": self.cities,
+            "failed": self.failed,
+            "updated_profiles": self.updated_profiles,
+            "last_duration": self.last_duration,
+        }
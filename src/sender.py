@@ -0,0 +1,316 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.types import BufferedInputFile, Message
+
+from config import (
+    logger,
+    settings,
+)
+from metrics import register_stats
+from utils import split_message, TELEGRAM_MESSAGE_LIMIT
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        self.delay()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    async def acquire(self) -> None:
+        while True:
+            delay = self.delay()
+            if not delay:
+                self.consume()
+                return
+            await asyncio.sleep(delay)
+
+
+class OutgoingMessage:
+    __slots__ = ("chat_id", "text", "photo", "caption", "future", "enqueued_at", "attempts")
+
+    def __init__(
+        self,
+        chat_id: int,
+        text: Optional[str] = None,
+        photo: Optional[BufferedInputFile] = None,
+        caption: Optional[str] = None,
+    ):
+        self.chat_id = chat_id
+        self.text = text
+        self.photo = photo
+        self.caption = caption
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class MessageSender:
+    def __init__(
+        self,
+        global_rate: float,
+        chat_rate: float,
+        chat_burst: float,
+        max_queue: int,
+        workers: int,
+        max_retries: int,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_queue = max_queue
+        self.workers = workers
+        self.max_retries = max_retries
+
+        self.bot: Optional[Bot] = None
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._chats: Dict[int, Deque[OutgoingMessage]] = {}
+        self._scheduled: Set[int] = set()
+        self._ready: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.merged = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, bot: Bot) -> None:
+        self.bot = bot
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self, timeout: float = 10) -> None:
+        if not self._tasks:
+            return
+
+        pending = [m.future for chat in self._chats.values() for m in chat]
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _enqueue(self, item: OutgoingMessage) -> asyncio.Future:
+        await self._slots.acquire()
+        self.queued += 1
+
+        self._chats.setdefault(item.chat_id, deque()).append(item)
+        if item.chat_id not in self._scheduled:
+            self._scheduled.add(item.chat_id)
+            self._ready.put_nowait(item.chat_id)
+
+        return item.future
+
+    async def send_text(self, chat_id: int, text: str) -> asyncio.Future:
+        future = None
+        for chunk in split_message(text):
+            future = await self._enqueue(OutgoingMessage(chat_id, text=chunk))
+        return future
+
+    async def send_photo(
+        self, chat_id: int, photo: BufferedInputFile, caption: Optional[str] = None
+    ) -> asyncio.Future:
+        return await self._enqueue(OutgoingMessage(chat_id, photo=photo, caption=caption))
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_queue:
+                self._prune_buckets()
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_buckets(self) -> None:
+        for chat_id, bucket in list(self._buckets.items()):
+            if chat_id not in self._chats:
+                bucket.delay()
+                if bucket.tokens >= bucket.capacity:
+                    del self._buckets[chat_id]
+
+    def _take_batch(self, chat: Deque[OutgoingMessage]) -> List[OutgoingMessage]:
+        batch = [chat.popleft()]
+        if batch[0].text is None:
+            return batch
+
+        length = len(batch[0].text)
+        while chat and chat[0].text is not None:
+            extra = len(chat[0].text) + 2
+            if length + extra > TELEGRAM_MESSAGE_LIMIT:
+                break
+            batch.append(chat.popleft())
+            length += extra
+
+        self.merged += len(batch) - 1
+        return batch
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id = await self._ready.get()
+            chat = self._chats.get(chat_id)
+
+            bucket = self._bucket(chat_id)
+            delay = bucket.delay()
+            if delay:
+                loop.call_later(delay, self._ready.put_nowait, chat_id)
+                continue
+            bucket.consume()
+
+            try:
+                await self.global_bucket.acquire()
+
+                batch = self._take_batch(chat)
+                await self._deliver(chat, batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error("Ошибка отправки сообщения в чат %s: %s", chat_id, exc)
+            finally:
+                if chat:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    self._scheduled.discard(chat_id)
+                    self._chats.pop(chat_id, None)
+
+    async def _deliver(self, chat: Deque[OutgoingMessage], batch: List[OutgoingMessage]) -> None:
+        head = batch[0]
+        error: Optional[BaseException] = None
+
+        try:
+            if head.photo is not None:
+                await self.bot.send_photo(head.chat_id, head.photo, caption=head.caption)
+            else:
+                text = "\n\n".join(item.text for item in batch)
+                await self.bot.send_message(head.chat_id, text)
+        except TelegramRetryAfter as exc:
+            logger.warning("Flood control: отправка приостановлена на %s сек", exc.retry_after)
+            self.global_bucket.pause(exc.retry_after)
+            if self._requeue(chat, batch, exc.retry_after):
+                return
+            error = exc
+        except TelegramNetworkError as exc:
+            if self._requeue(chat, batch, min(2 ** head.attempts, 10)):
+                return
+            error = exc
+        except Exception as exc:
+            error = exc
+
+        self._finish(batch, error)
+
+    def _requeue(self, chat: Deque[OutgoingMessage], batch: List[OutgoingMessage], delay: float) -> bool:
+        head = batch[0]
+        if head.attempts >= self.max_retries:
+            return False
+
+        head.attempts += 1
+        self.retried += 1
+        self.merged -= len(batch) - 1
+        self._bucket(head.chat_id).pause(delay)
+        chat.extendleft(reversed(batch))
+        return True
+
+    def _finish(self, batch: List[OutgoingMessage], error: Optional[BaseException]) -> None:
+        now = time.monotonic()
+        for item in batch:
+            self._slots.release()
+            self.queued -= 1
+
+            latency = now - item.enqueued_at
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+
+            if item.future.done():
+                continue
+            if error is None:
+                item.future.set_result(None)
+            else:
+                item.future.set_exception(error)
+                item.future.exception()
+
+        if error is None:
+            self.sent += len(batch)
+        else:
+            self.failed += len(batch)
+            logger.error("Не удалось отправить сообщение в чат %s: %s", batch[0].chat_id, error)
+
+    def stats(self) -> Dict[str, float]:
+        delivered = self.sent + self.failed
+        return {
+            "queue_depth": self.queued,
+            "active_chats": len(self._chats),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "merged": self.merged,
+            "latency_avg": self.latency_sum / delivered if delivered else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+
+sender = MessageSender(
+    global_rate=settings.sender_global_rate,
+    chat_rate=settings.sender_chat_rate,
+    chat_burst=settings.sender_chat_burst,
+    max_queue=settings.sender_max_queue,
+    workers=settings.sender_workers,
+    max_retries=settings.sender_max_retries,
+)
+
+register_stats(
+    "bot_sender",
+    "Outgoing message queue statistics",
+    "sender",
+    {"telegram": sender.stats},
+    ["queue_depth", "active_chats", "sent", "failed", "retried", "merged", "latency_avg", "latency_max"],
+)
+
+
+async def answer(message: Message, text: str) -> None:
+    if not sender.running:
+        for chunk in split_message(text):
+            await message.answer(chunk)
+        return
+
+    await sender.send_text(message.chat.id, text)
+
+
+async def answer_photo(message: Message, photo: BufferedInputFile, caption: Optional[str] = None) -> None:
+    if not sender.running:
+        await message.answer_photo(photo, caption=caption)
+        return
+
+    await sender.send_photo(message.chat.id, photo, caption)
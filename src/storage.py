@@ -0,0 +1,580 @@
+import asyncio
+import contextlib
+import json
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, DefaultKeyBuilder, StorageKey
+from aiogram.fsm.storage.memory import DisabledEventIsolation, MemoryStorage
+
+from config import (
+    logger,
+    settings,
+)
+from models import UserProfile
+
+
+class UserRepository:
+    locks: Optional[BaseEventIsolation] = None
+
+    async def start(self) -> None:
+        pass
+
+    async def get(self, user_id: int) -> Optional[UserProfile]:
+        raise NotImplementedError
+
+    async def save(self, profile: UserProfile) -> None:
+        raise NotImplementedError
+
+    def mark_dirty(self, profile: UserProfile) -> None:
+        pass
+
+    def resident(self) -> Iterable[UserProfile]:
+        raise NotImplementedError
+
+    def iter_all(self, batch_size: int = 500) -> AsyncIterator[List[Dict]]:
+        raise NotImplementedError
+
+    async def import_many(self, profiles: List[UserProfile]) -> None:
+        for profile in profiles:
+            await self.save(profile)
+
+    async def commit(self, user_id: int) -> bool:
+        return True
+
+    def lock(self, user_id: int):
+        if hasattr(self.locks, "lock_for"):
+            return self.locks.lock_for(user_id)
+        return contextlib.nullcontext()
+
+    async def update(
+        self, user_id: int, change: Callable[[UserProfile], Awaitable[bool]], attempts: int = 3
+    ) -> bool:
+        async with self.lock(user_id):
+            for _ in range(attempts):
+                profile = await self.get(user_id)
+                if profile is None or not await change(profile):
+                    return False
+                self.mark_dirty(profile)
+                if await self.commit(user_id):
+                    return True
+        return False
+
+    async def flush(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        await self.flush()
+
+
+class InMemoryUserRepository(UserRepository):
+    def __init__(self):
+        self._profiles: Dict[int, UserProfile] = {}
+
+    async def get(self, user_id: int) -> Optional[UserProfile]:
+        return self._profiles.get(user_id)
+
+    async def save(self, profile: UserProfile) -> None:
+        self._profiles[profile.user_id] = profile
+
+    def resident(self) -> Iterable[UserProfile]:
+        return list(self._profiles.values())
+
+    async def iter_all(self, batch_size: int = 500) -> AsyncIterator[List[Dict]]:
+        user_ids = sorted(self._profiles)
+        for start in range(0, len(user_ids), batch_size):
+            batch = [
+                self._profiles[user_id].to_dict()
+                for user_id in user_ids[start:start + batch_size]
+                if user_id in self._profiles
+            ]
+            yield batch
+            await asyncio.sleep(0)
+
+
+class WriteBehindUserRepository(UserRepository):
+    def __init__(self, max_resident: int, flush_interval: float):
+        self.max_resident = max_resident
+        self.flush_interval = flush_interval
+
+        self._resident: "OrderedDict[int, UserProfile]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        self._evicted: Dict[int, str] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    async def _load(self, user_id: int) -> Optional[str]:
+        raise NotImplementedError
+
+    async def _write_many(self, payloads: Dict[int, str]) -> None:
+        raise NotImplementedError
+
+    async def _store(self, payloads: Dict[int, str]) -> None:
+        await self._write_many(payloads)
+
+    def _forget(self, user_id: int) -> None:
+        pass
+
+    def _scan(self, batch_size: int) -> AsyncIterator[List[Tuple[int, str]]]:
+        raise NotImplementedError
+
+    async def start(self) -> None:
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as exc:
+                logger.error("Ошибка при сохранении профилей: %s", exc)
+
+    async def get(self, user_id: int) -> Optional[UserProfile]:
+        profile = self._resident.get(user_id)
+        if profile is not None:
+            self._resident.move_to_end(user_id)
+            return profile
+
+        future = self._loading.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(self._load_profile(user_id))
+            self._loading[user_id] = future
+            future.add_done_callback(lambda _: self._loading.pop(user_id, None))
+
+        return await asyncio.shield(future)
+
+    async def _load_profile(self, user_id: int) -> Optional[UserProfile]:
+        payload = self._evicted.get(user_id)
+        if payload is None:
+            payload = await self._load(user_id)
+        if payload is None:
+            return None
+
+        if user_id in self._dirty:
+            return self._resident[user_id]
+
+        profile = UserProfile.from_dict(json.loads(payload))
+        self._remember(profile)
+        return profile
+
+    def _remember(self, profile: UserProfile) -> None:
+        self._resident[profile.user_id] = profile
+        self._resident.move_to_end(profile.user_id)
+
+        while len(self._resident) > self.max_resident:
+            user_id, evicted = self._resident.popitem(last=False)
+            if user_id in self._dirty:
+                self._dirty.discard(user_id)
+                self._evicted[user_id] = self._serialize(evicted)
+            else:
+                self._forget(user_id)
+
+    @staticmethod
+    def _serialize(profile: UserProfile) -> str:
+        return json.dumps(profile.to_dict(), ensure_ascii=False)
+
+    async def save(self, profile: UserProfile) -> None:
+        self._remember(profile)
+        self.mark_dirty(profile)
+
+    def mark_dirty(self, profile: UserProfile) -> None:
+        if profile.user_id in self._resident:
+            self._dirty.add(profile.user_id)
+        else:
+            self._evicted[profile.user_id] = self._serialize(profile)
+
+    def resident(self) -> Iterable[UserProfile]:
+        return list(self._resident.values())
+
+    async def iter_all(self, batch_size: int = 500) -> AsyncIterator[List[Dict]]:
+        await self.flush()
+
+        async for rows in self._scan(batch_size):
+            records = await asyncio.to_thread(lambda: [json.loads(payload) for _, payload in rows])
+            for index, (user_id, _) in enumerate(rows):
+                profile = self._resident.get(user_id)
+                if profile is not None:
+                    records[index] = profile.to_dict()
+            yield records
+
+    async def import_many(self, profiles: List[UserProfile]) -> None:
+        cold = {}
+        for profile in profiles:
+            if profile.user_id in self._resident:
+                self._remember(profile)
+                self._dirty.add(profile.user_id)
+            else:
+                self._evicted.pop(profile.user_id, None)
+                cold[profile.user_id] = profile
+
+        if cold:
+            payloads = await asyncio.to_thread(
+                lambda: {user_id: self._serialize(profile) for user_id, profile in cold.items()}
+            )
+            await self._write_many(payloads)
+
+    async def flush(self, user_ids: Optional[Iterable[int]] = None) -> None:
+        async with self._flush_lock:
+            if user_ids is None:
+                payloads = self._evicted
+                self._evicted = {}
+                dirty = self._dirty
+                self._dirty = set()
+            else:
+                payloads = {
+                    user_id: self._evicted.pop(user_id) for user_id in user_ids if user_id in self._evicted
+                }
+                dirty = {user_id for user_id in user_ids if user_id in self._dirty}
+                self._dirty -= dirty
+
+            for user_id in dirty:
+                profile = self._resident.get(user_id)
+                if profile is not None:
+                    payloads[user_id] = self._serialize(profile)
+
+            if not payloads:
+                return
+
+            try:
+                await self._store(payloads)
+            except Exception:
+                for user_id, payload in payloads.items():
+                    if user_id in self._resident:
+                        self._dirty.add(user_id)
+                    else:
+                        self._evicted.setdefault(user_id, payload)
+                raise
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+
+        await self.flush()
+
+
+class SQLiteUserRepository(WriteBehindUserRepository):
+    def __init__(self, path: str, max_resident: int, flush_interval: float):
+        super().__init__(max_resident, flush_interval)
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "user_id INTEGER PRIMARY KEY, payload TEXT NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _select(self, user_id: int) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT payload FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _select_page(self, after: int, limit: int) -> List[Tuple[int, str]]:
+        return self._connect().execute(
+            "SELECT user_id, payload FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            (after, limit)
+        ).fetchall()
+
+    def _upsert_many(self, payloads: Dict[int, str]) -> None:
+        db = self._connect()
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO users (user_id, payload) VALUES (?, ?)",
+                payloads.items()
+            )
+
+    async def _load(self, user_id: int) -> Optional[str]:
+        return await self._run(self._select, user_id)
+
+    async def _write_many(self, payloads: Dict[int, str]) -> None:
+        await self._run(self._upsert_many, payloads)
+
+    async def _scan(self, batch_size: int) -> AsyncIterator[List[Tuple[int, str]]]:
+        after = -(2 ** 63)
+        while True:
+            rows = await self._run(self._select_page, after, batch_size)
+            if not rows:
+                return
+            yield rows
+            after = rows[-1][0]
+
+    async def close(self) -> None:
+        await super().close()
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=True)
+
+
+class RedisUserRepository(WriteBehindUserRepository):
+    def __init__(
+        self,
+        redis,
+        max_resident: int,
+        flush_interval: float,
+        key_prefix: str,
+        profile_ttl: Optional[int] = None,
+    ):
+        super().__init__(max_resident, flush_interval)
+        self.redis = redis
+        self.key_prefix = key_prefix
+        self.profile_ttl = profile_ttl
+
+        self._versions: Dict[int, int] = {}
+        self._rejected: Set[int] = set()
+        self.conflicts = 0
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.key_prefix}:user:{user_id}"
+
+    def _version_key(self, user_id: int) -> str:
+        return f"{self.key_prefix}:version:{user_id}"
+
+    async def _load(self, user_id: int) -> Optional[str]:
+        payload = await self.redis.get(self._key(user_id))
+        if isinstance(payload, bytes):
+            payload = payload.decode()
+        return payload
+
+    async def get(self, user_id: int) -> Optional[UserProfile]:
+        if user_id in self._resident and user_id not in self._dirty:
+            version = int(await self.redis.get(self._version_key(user_id)) or 0)
+            if version != self._versions.get(user_id) and user_id not in self._dirty:
+                self._resident.pop(user_id, None)
+        return await super().get(user_id)
+
+    async def _load_profile(self, user_id: int) -> Optional[UserProfile]:
+        if user_id in self._dirty or user_id in self._evicted:
+            return await super()._load_profile(user_id)
+
+        payload, version = await self.redis.mget(self._key(user_id), self._version_key(user_id))
+        if payload is None:
+            return None
+        if user_id in self._dirty:
+            return self._resident[user_id]
+
+        if isinstance(payload, bytes):
+            payload = payload.decode()
+        profile = UserProfile.from_dict(json.loads(payload))
+        self._versions[user_id] = int(version or 0)
+        self._remember(profile)
+        return profile
+
+    def _forget(self, user_id: int) -> None:
+        self._versions.pop(user_id, None)
+
+    async def save(self, profile: UserProfile) -> None:
+        version = int(await self.redis.get(self._version_key(profile.user_id)) or 0)
+        await super().save(profile)
+        self._versions[profile.user_id] = version
+
+    async def commit(self, user_id: int) -> bool:
+        self._rejected.discard(user_id)
+        await self.flush([user_id])
+        return user_id not in self._rejected
+
+    async def _write_many(self, payloads: Dict[int, str]) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for user_id, payload in payloads.items():
+                pipe.set(self._key(user_id), payload, ex=self.profile_ttl)
+                pipe.incr(self._version_key(user_id))
+            versions = (await pipe.execute())[1::2]
+
+        for user_id, version in zip(payloads, versions):
+            if user_id in self._resident:
+                self._versions[user_id] = version
+
+    async def _compare_and_set(self, payloads: Dict[int, str]) -> Dict[int, int]:
+        version_keys = [self._version_key(user_id) for user_id in payloads]
+        written: Dict[int, int] = {}
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            await pipe.watch(*version_keys)
+            current = await pipe.mget(version_keys)
+
+            pipe.multi()
+            for (user_id, payload), version in zip(payloads.items(), current):
+                version = int(version or 0)
+                if version != self._versions.get(user_id, 0):
+                    continue
+                pipe.set(self._key(user_id), payload, ex=self.profile_ttl)
+                pipe.set(self._version_key(user_id), version + 1, ex=self.profile_ttl)
+                written[user_id] = version + 1
+
+            if written:
+                await pipe.execute()
+        return written
+
+    async def _store(self, payloads: Dict[int, str]) -> None:
+        from redis.exceptions import WatchError
+
+        try:
+            written = await self._compare_and_set(payloads)
+        except WatchError:
+            written = {}
+            for user_id, payload in payloads.items():
+                try:
+                    written.update(await self._compare_and_set({user_id: payload}))
+                except WatchError:
+                    pass
+
+        for user_id in payloads:
+            if user_id not in written:
+                self._reject(user_id)
+            elif user_id in self._resident:
+                self._versions[user_id] = written[user_id]
+            else:
+                self._versions.pop(user_id, None)
+
+    def _reject(self, user_id: int) -> None:
+        self.conflicts += 1
+        self._rejected.add(user_id)
+        self._resident.pop(user_id, None)
+        self._versions.pop(user_id, None)
+        logger.error(
+            "Профиль %s изменён другим воркером, локальные изменения не записаны",
+            user_id,
+            extra={"user_id": user_id}
+        )
+
+    async def _scan(self, batch_size: int) -> AsyncIterator[List[Tuple[int, str]]]:
+        keys: List = []
+        async for key in self.redis.scan_iter(match=self._key("*"), count=batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                yield await self._fetch_many(keys)
+                keys = []
+        if keys:
+            yield await self._fetch_many(keys)
+
+    async def _fetch_many(self, keys: List) -> List[Tuple[int, str]]:
+        rows = []
+        for key, payload in zip(keys, await self.redis.mget(keys)):
+            if payload is None:
+                continue
+            if isinstance(key, bytes):
+                key = key.decode()
+            if isinstance(payload, bytes):
+                payload = payload.decode()
+            rows.append((int(key.rsplit(":", 1)[1]), payload))
+        return rows
+
+    async def close(self) -> None:
+        await super().close()
+        await self.redis.aclose()
+
+
+class ShardedEventIsolation(BaseEventIsolation):
+    def __init__(self, shards: int):
+        self._locks: List[Optional[asyncio.Lock]] = [None] * shards
+
+    def lock_for(self, user_id: int) -> asyncio.Lock:
+        index = hash(user_id) % len(self._locks)
+        lock = self._locks[index]
+        if lock is None:
+            lock = self._locks[index] = asyncio.Lock()
+        return lock
+
+    def lock(self, key: StorageKey) -> asyncio.Lock:
+        return self.lock_for(key.user_id)
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisUserEventIsolation(BaseEventIsolation):
+    def __init__(self, redis, key_prefix: str, timeout: float = 60):
+        self.redis = redis
+        self.key_prefix = key_prefix
+        self.timeout = timeout
+
+    def lock_for(self, user_id: int):
+        return self.redis.lock(f"{self.key_prefix}:lock:{user_id}", timeout=self.timeout)
+
+    def lock(self, key: StorageKey):
+        return self.lock_for(key.user_id)
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+def create_events_isolation() -> BaseEventIsolation:
+    if settings.fsm_storage == "redis" or settings.storage_backend == "redis":
+        return RedisUserEventIsolation(create_redis_client(), settings.redis_key_prefix)
+
+    if not settings.user_lock_shards:
+        return DisabledEventIsolation()
+    return ShardedEventIsolation(settings.user_lock_shards)
+
+
+def create_redis_client():
+    from redis.asyncio import Redis
+
+    return Redis.from_url(settings.redis_url)
+
+
+def create_fsm_storage() -> BaseStorage:
+    if settings.fsm_storage == "memory":
+        return MemoryStorage()
+
+    if settings.fsm_storage == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage(
+            redis=create_redis_client(),
+            key_builder=DefaultKeyBuilder(prefix=f"{settings.redis_key_prefix}:fsm"),
+            state_ttl=settings.fsm_state_ttl or None,
+            data_ttl=settings.fsm_data_ttl or None,
+        )
+
+    raise RuntimeError(f"Unknown FSM storage: {settings.fsm_storage}")
+
+
+def create_user_repository(locks: Optional[BaseEventIsolation] = None) -> UserRepository:
+    repository = _build_user_repository()
+    repository.locks = locks
+    return repository
+
+
+def _build_user_repository() -> UserRepository:
+    if settings.storage_backend == "memory":
+        return InMemoryUserRepository()
+
+    if settings.storage_backend == "sqlite":
+        return SQLiteUserRepository(
+            path=settings.storage_path,
+            max_resident=settings.storage_max_resident,
+            flush_interval=settings.storage_flush_interval,
+        )
+
+    if settings.storage_backend == "redis":
+        return RedisUserRepository(
+            redis=create_redis_client(),
+            max_resident=settings.storage_max_resident,
+            flush_interval=settings.storage_flush_interval,
+            key_prefix=settings.redis_key_prefix,
+            profile_ttl=settings.redis_profile_ttl or None,
+        )
+
+    raise RuntimeError(f"Unknown storage backend: {settings.storage_backend}")
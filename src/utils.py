@@ -1,34 +1,208 @@
+import asyncio
 import io
-from typing import Optional, Dict
+import multiprocessing
+import threading
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+from typing import Optional, Dict, List
 
 import aiohttp
-import matplotlib.pyplot as plt
-from fatsecret import Fatsecret
 
-from models import DayRecord
-from config import logger, CONSUMER_KEY, CONSUMER_SECRET
+from cache import TTLCache, NutritionCache
+from charts import render_daily_charts, render_trend_charts, file_extension, warm_up
+from models import DayRecord, UserProfile
+from metrics import observe_external, register_stats
+from resilience import ResilientEndpoint, CircuitOpen
+from config import (
+    logger,
+    settings,
+)
+
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+class ChartQueueFull(RuntimeError):
+    pass
+
+
+_http_session: Optional[aiohttp.ClientSession] = None
+
+temperature_cache = TTLCache(maxsize=settings.weather_cache_size, ttl=settings.weather_cache_ttl)
+
+nutrition_cache = NutritionCache(
+    path=settings.nutrition_cache_path or None,
+    maxsize=settings.nutrition_cache_size,
+    ttl=settings.nutrition_cache_ttl,
+    negative_ttl=settings.nutrition_negative_ttl,
+)
+
+_fatsecret_executor: Optional[ThreadPoolExecutor] = None
+_fatsecret_local = threading.local()
+
+_chart_executor: Optional[ProcessPoolExecutor] = None
+_chart_slots = asyncio.Semaphore(settings.chart_max_pending)
+chart_cache = TTLCache(maxsize=settings.chart_cache_size, ttl=settings.chart_cache_ttl)
+
+register_stats(
+    "bot_cache",
+    "Cache statistics",
+    "cache",
+    {
+        "weather": temperature_cache.stats,
+        "nutrition": nutrition_cache.stats,
+        "charts": chart_cache.stats,
+    },
+    ["size", "hits", "misses", "hit_ratio", "evictions"],
+)
+
+weather_endpoint = ResilientEndpoint(
+    "openweathermap",
+    deadline=settings.weather_deadline,
+    failure_threshold=settings.circuit_failure_threshold,
+    reset_timeout=settings.circuit_reset_timeout,
+    hedge_min_delay=settings.hedge_min_delay,
+    hedge_min_samples=settings.hedge_min_samples,
+)
+openfoodfacts_endpoint = ResilientEndpoint(
+    "openfoodfacts",
+    deadline=settings.openfoodfacts_deadline,
+    failure_threshold=settings.circuit_failure_threshold,
+    reset_timeout=settings.circuit_reset_timeout,
+    hedge_min_delay=settings.hedge_min_delay,
+    hedge_min_samples=settings.hedge_min_samples,
+)
+fatsecret_endpoint = ResilientEndpoint(
+    "fatsecret",
+    deadline=settings.fatsecret_timeout,
+    failure_threshold=settings.circuit_failure_threshold,
+    reset_timeout=settings.circuit_reset_timeout,
+    hedge=False,
+)
+
+register_stats(
+    "bot_circuit",
+    "External API circuit breaker statistics",
+    "endpoint",
+    {
+        endpoint.name: endpoint.stats
+        for endpoint in (weather_endpoint, openfoodfacts_endpoint, fatsecret_endpoint)
+    },
+    ["state", "calls", "failures", "timeouts", "rejected", "hedged", "opened", "latency_p95"],
+)
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=settings.http_pool_limit,
+        limit_per_host=settings.http_pool_limit_per_host,
+        keepalive_timeout=settings.http_keepalive_timeout,
+        ttl_dns_cache=settings.http_dns_cache_ttl,
+        use_dns_cache=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=settings.http_total_timeout,
+        connect=settings.http_connect_timeout,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+def set_http_session(session: Optional[aiohttp.ClientSession]) -> None:
+    global _http_session
+    _http_session = session
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = create_http_session()
+    return _http_session
+
+
+async def close_http_session() -> None:
+    global _http_session
+    session, _http_session = _http_session, None
+    if session is not None and not session.closed:
+        await session.close()
+
+
+def city_cache_key(city: str) -> str:
+    return " ".join(city.split()).casefold()
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    chunks = []
+    current = ""
+
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+
+    if current or not chunks:
+        chunks.append(current)
+
+    return chunks
+
+
+@observe_external("weather")
+async def fetch_city_temperature(city: str, api_key: str) -> Optional[float]:
+    key = city_cache_key(city)
+    try:
+        return await temperature_cache.get_or_load(key, lambda: load_city_temperature(city, api_key))
+    except Exception as exc:
+        logger.warning("Погода для %s недоступна (%s), используем кэш", city, exc)
+        return temperature_cache.peek(key, allow_expired=True)
 
 
-async def fetch_city_temperature(city: str, api_key: str) -> Optional[float]:
-    url = "http://api.openweathermap.org/data/2.5/weather"
+async def load_city_temperature(city: str, api_key: str) -> Optional[float]:
+    return await weather_endpoint.call(lambda: request_city_temperature(city, api_key))
+
+
+@observe_external("openweathermap")
+async def request_city_temperature(city: str, api_key: str) -> Optional[float]:
+    url = settings.weather_api_url
     params = {
         "q": city,
         "appid": api_key,
         "units": "metric"
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params) as response:
-            if response.status != 200:
-                logger.error("Weather API error: %s", response.status)
-                return None
+    session = get_http_session()
+    async with session.get(url, params=params) as response:
+        if response.status >= 500 or response.status == 429:
+            raise RuntimeError(f"Weather API error: {response.status}")
+
+        if response.status != 200:
+            logger.error("Weather API error: %s", response.status)
+            return None
 
-            payload = await response.json()
-            return payload.get("main", {}).get("temp")
+        payload = await response.json()
+        return payload.get("main", {}).get("temp")
 
 
+@observe_external("openfoodfacts")
 async def lookup_food_openfacts(name: str) -> Optional[Dict]:
-    url = "https://world.openfoodfacts.org/cgi/search.pl"
+    try:
+        return await openfoodfacts_endpoint.call(lambda: request_food_openfacts(name))
+    except Exception as exc:
+        logger.error("OpenFoodFacts error: %s", exc or type(exc).__name__)
+        return None
+
+
+async def request_food_openfacts(name: str) -> Optional[Dict]:
+    url = settings.openfoodfacts_api_url
     params = {
         "search_terms": name,
         "search_simple": 1,
@@ -38,90 +212,211 @@ async def lookup_food_openfacts(name: str) -> Optional[Dict]:
         "page_size": 1
     }
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                if response.status != 200:
-                    return None
+    session = get_http_session()
+    async with session.get(url, params=params) as response:
+        if response.status >= 500 or response.status == 429:
+            raise RuntimeError(f"HTTP {response.status}")
+
+        if response.status != 200:
+            return None
 
-                data = await response.json()
-                products = data.get("products")
+        data = await response.json()
+        products = data.get("products")
 
-                if not products:
-                    return None
+        if not products:
+            return None
 
-                product = products[0]
-                kcal = product.get("nutriments", {}).get("energy-kcal_100g")
+        product = products[0]
+        kcal = product.get("nutriments", {}).get("energy-kcal_100g")
 
-                if not isinstance(kcal, (int, float)) or kcal <= 0:
-                    return None
+        if not isinstance(kcal, (int, float)) or kcal <= 0:
+            return None
 
-                return {
-                    "name": product.get("product_name", name).strip() or name,
-                    "calories": float(kcal)
-                }
-    except Exception as exc:
-        logger.error("OpenFoodFacts error: %s", exc)
+        return {
+            "name": product.get("product_name", name).strip() or name,
+            "calories": float(kcal)
+        }
+
+
+def get_fatsecret_executor() -> ThreadPoolExecutor:
+    global _fatsecret_executor
+    if _fatsecret_executor is None:
+        _fatsecret_executor = ThreadPoolExecutor(
+            max_workers=settings.fatsecret_max_workers,
+            thread_name_prefix="fatsecret"
+        )
+    return _fatsecret_executor
+
+
+def shutdown_fatsecret_executor() -> None:
+    global _fatsecret_executor
+    executor, _fatsecret_executor = _fatsecret_executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _fatsecret_client():
+    client = getattr(_fatsecret_local, "client", None)
+    if client is None:
+        from fatsecret import Fatsecret
+
+        client = Fatsecret(settings.consumer_key, settings.consumer_secret)
+        _fatsecret_local.client = client
+    return client
+
+
+def _search_fatsecret(name: str) -> Optional[Dict]:
+    client = _fatsecret_client()
+    search = client.foods_search(name)
+
+    if not search:
         return None
 
+    food_id = search[0]["food_id"]
+    details = client.food_get_v2(food_id)
 
-async def lookup_food_fatsecret(name: str) -> Optional[Dict]:
-    try:
-        client = Fatsecret(CONSUMER_KEY, CONSUMER_SECRET)
-        search = client.foods_search(name)
+    servings = details.get("servings", {}).get("serving")
+    if not servings:
+        return None
 
-        if not search:
-            return None
+    serving = servings[0] if isinstance(servings, list) else servings
 
-        food_id = search[0]["food_id"]
-        details = client.food_get_v2(food_id)
+    amount = float(serving.get("metric_serving_amount", 100))
+    factor = 100 / amount if amount else 1
 
-        servings = details.get("servings", {}).get("serving")
-        if not servings:
-            return None
+    return {
+        "name": details.get("food_name", name),
+        "calories": round(float(serving.get("calories", 0)) * factor),
+        "protein": round(float(serving.get("protein", 0)) * factor, 1),
+        "fat": round(float(serving.get("fat", 0)) * factor, 1),
+        "carbs": round(float(serving.get("carbohydrate", 0)) * factor, 1),
+    }
 
-        serving = servings[0] if isinstance(servings, list) else servings
 
-        amount = float(serving.get("metric_serving_amount", 100))
-        factor = 100 / amount if amount else 1
+@observe_external("fatsecret")
+async def lookup_food_fatsecret(name: str) -> Optional[Dict]:
+    loop = asyncio.get_running_loop()
 
-        return {
-            "name": details.get("food_name", name),
-            "calories": round(float(serving.get("calories", 0)) * factor),
-            "protein": round(float(serving.get("protein", 0)) * factor, 1),
-            "fat": round(float(serving.get("fat", 0)) * factor, 1),
-            "carbs": round(float(serving.get("carbohydrate", 0)) * factor, 1),
-        }
+    try:
+        return await fatsecret_endpoint.call(
+            lambda: loop.run_in_executor(get_fatsecret_executor(), _search_fatsecret, name),
+            is_failure=lambda result: bool(result) and bool(result.get("error"))
+        )
+
+    except CircuitOpen:
+        return {"error": "unavailable", "name": name}
+
+    except asyncio.TimeoutError:
+        logger.error("FatSecret timeout: %s", name)
+        return {"error": "timeout", "name": name}
 
     except Exception as exc:
         logger.error("FatSecret error: %s", exc)
         return {"error": str(exc), "name": name}
 
 
-async def build_daily_charts(day: DayRecord) -> io.BytesIO:
-    fig, axes = plt.subplots(2, 1, figsize=(9, 10))
+def get_chart_executor() -> ProcessPoolExecutor:
+    global _chart_executor
+    if _chart_executor is None:
+        _chart_executor = ProcessPoolExecutor(
+            max_workers=settings.chart_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _chart_executor
+
 
+def shutdown_chart_executor() -> None:
+    global _chart_executor
+    executor, _chart_executor = _chart_executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def chart_filename(name: str) -> str:
+    return f"{name}.{file_extension(settings.chart_format)}"
+
+
+async def _render_in_pool(render, *args) -> bytes:
+    try:
+        await asyncio.wait_for(_chart_slots.acquire(), timeout=settings.chart_queue_timeout)
+    except asyncio.TimeoutError:
+        raise ChartQueueFull("Chart render queue is full")
+
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_chart_executor(), render, *args)
+    finally:
+        _chart_slots.release()
+
+
+@observe_external("charts")
+async def build_daily_charts(day: DayRecord) -> io.BytesIO:
     water_actual = day.logged_water
     water_target = day.water_goal
 
     calorie_net = day.logged_calories - day.water_goal
     calorie_target = day.calorie_goal
 
-    axes[0].bar(["actual", "target"], [water_actual, water_target])
-    axes[0].set_title("Daily water balance (ml)")
-
-    axes[1].bar(["net", "target"], [calorie_net, calorie_target])
-    axes[1].set_title("Daily calorie balance (kcal)")
+    args = (
+        water_actual,
+        water_target,
+        calorie_net,
+        calorie_target,
+        settings.chart_dpi,
+        settings.chart_format,
+        settings.chart_quality,
+    )
+    image = await chart_cache.get_or_load(
+        ("daily",) + args,
+        lambda: _render_in_pool(render_daily_charts, *args)
+    )
+
+    return io.BytesIO(image)
+
+
+@observe_external("charts")
+async def build_trend_charts(profile: UserProfile, days: int, last_day: date) -> io.BytesIO:
+    aggregates = profile.aggregates
+    last_ordinal = last_day.toordinal()
+
+    start = max(0, bisect_right(aggregates.ordinals, last_ordinal - days) - 1)
+    end = bisect_right(aggregates.ordinals, last_ordinal)
+
+    record = profile.daily_stats.get(last_day.isoformat())
+    args = (
+        last_ordinal,
+        days,
+        aggregates.ordinals[start:end].tobytes(),
+        aggregates.water[start:end].tobytes(),
+        aggregates.calories[start:end].tobytes(),
+        aggregates.burned[start:end].tobytes(),
+        record.water_goal if record else None,
+        record.calorie_goal if record else None,
+        max(1, min(settings.chart_trend_average, days // 2)),
+        settings.chart_dpi,
+        settings.chart_format,
+        settings.chart_quality,
+    )
+    image = await chart_cache.get_or_load(
+        ("trend",) + args,
+        lambda: _render_in_pool(render_trend_charts, *args)
+    )
+
+    return io.BytesIO(image)
+
+
+async def prewarm_heavy_modules(delay: float = settings.prewarm_delay) -> None:
+    await asyncio.sleep(delay)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
 
-    for ax in axes:
-        ax.grid(axis="y", alpha=0.4)
-        ax.spines["top"].set_visible(False)
-        ax.spines["right"].set_visible(False)
-
-    buffer = io.BytesIO()
-    plt.tight_layout()
-    plt.savefig(buffer, format="png", dpi=250)
-    buffer.seek(0)
-    plt.close()
+    try:
+        await asyncio.gather(
+            loop.run_in_executor(get_fatsecret_executor(), _fatsecret_client),
+            *(loop.run_in_executor(get_chart_executor(), warm_up) for _ in range(settings.chart_workers)),
+        )
+    except Exception as exc:
+        logger.warning("Не удалось заранее загрузить модули: %s", exc)
+        return
 
-    return buffer
\ No newline at end of file
+    logger.info("Тяжёлые модули загружены в фоне за %.2f сек", loop.time() - started)
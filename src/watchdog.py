@@ -0,0 +1,167 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+
+from config import logger, settings
+from metrics import Counter, Histogram
+
+
+LOOP_LAG_SECONDS = Histogram(
+    "bot_event_loop_lag_seconds",
+    "Delay between scheduled and actual wake-up of the watchdog heartbeat",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+LOOP_STALLS = Counter(
+    "bot_event_loop_stalls_total", "Event loop blocks longer than the watchdog threshold", ["handler"]
+)
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float, interval: float, stack_depth: int = 30):
+        self.threshold = threshold
+        self.interval = interval
+        self.stack_depth = stack_depth
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._monitor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        self._beat = time.monotonic()
+        self._reported = False
+        self._handlers: Dict[asyncio.Task, Tuple[str, str, Optional[int]]] = {}
+
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    @property
+    def running(self) -> bool:
+        return self._heartbeat is not None
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+
+        self._heartbeat = asyncio.create_task(self._run_heartbeat())
+        self._monitor = threading.Thread(target=self._run_monitor, name="loop-watchdog", daemon=True)
+        self._monitor.start()
+        logger.info("Watchdog цикла событий запущен (порог %.0f мс)", self.threshold * 1000)
+
+    async def stop(self) -> None:
+        if self._heartbeat is None:
+            return
+
+        self._stop.set()
+        self._heartbeat.cancel()
+        await asyncio.gather(self._heartbeat, return_exceptions=True)
+        self._heartbeat = None
+        self._monitor.join(timeout=self.interval * 4)
+        self._monitor = None
+
+    def enter_handler(self, handler: str, update_type: str, user_id: Optional[int]) -> Optional[asyncio.Task]:
+        task = asyncio.current_task()
+        if task is not None:
+            self._handlers[task] = (handler, update_type, user_id)
+        return task
+
+    def exit_handler(self, task: Optional[asyncio.Task]) -> None:
+        if task is not None:
+            self._handlers.pop(task, None)
+
+    def _active_handler(self) -> Tuple[str, str, Optional[int]]:
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        return self._handlers.get(task, ("unknown", "unknown", None))
+
+    async def _run_heartbeat(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+
+            self._beat = now
+            self._reported = False
+            LOOP_LAG_SECONDS.observe(value=lag)
+            self.max_lag = max(self.max_lag, lag)
+
+            if lag >= self.threshold:
+                logger.warning(
+                    "Цикл событий был заблокирован %.0f мс",
+                    lag * 1000,
+                    extra={"duration_ms": round(lag * 1000, 2)}
+                )
+
+    def _run_monitor(self) -> None:
+        poll = min(self.interval, self.threshold / 2)
+        while not self._stop.wait(poll):
+            blocked = time.monotonic() - self._beat - self.interval
+            if blocked < self.threshold or self._reported:
+                continue
+
+            self._reported = True
+            self._report(blocked)
+
+    def _report(self, blocked: float) -> None:
+        handler, update_type, user_id = self._active_handler()
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame, limit=-self.stack_depth)) if frame else ""
+
+        self.stalls += 1
+        LOOP_STALLS.inc(handler)
+        logger.warning(
+            "Цикл событий заблокирован уже %.0f мс, обработчик %s (%s):\n%s",
+            blocked * 1000,
+            handler,
+            update_type,
+            stack,
+            extra={
+                "handler": handler,
+                "update_type": update_type,
+                "user_id": user_id,
+                "duration_ms": round(blocked * 1000, 2),
+            }
+        )
+
+    def stats(self) -> Dict[str, float]:
+        return {"max_lag": self.max_lag, "stalls": self.stalls}
+
+
+class HandlerTrackingMiddleware(BaseMiddleware):
+    def __init__(self, watchdog: LoopWatchdog):
+        self.watchdog = watchdog
+
+    async def __call__(self, handler, event, data: dict):
+        if not self.watchdog.running:
+            return await handler(event, data)
+
+        handler_object = data.get("handler")
+        update = data.get("event_update")
+        user = data.get("event_from_user")
+
+        task = self.watchdog.enter_handler(
+            handler_object.callback.__name__ if handler_object else "unknown",
+            update.event_type if update else "unknown",
+            user.id if user else None,
+        )
+        try:
+            return await handler(event, data)
+        finally:
+            self.watchdog.exit_handler(task)
+
+
+watchdog = LoopWatchdog(
+    threshold=settings.watchdog_threshold,
+    interval=settings.watchdog_interval,
+    stack_depth=settings.watchdog_stack_depth,
+)
@@ -0,0 +1,65 @@
+import asyncio
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import (
+    logger,
+    settings,
+)
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+def create_webhook_app(dispatcher: Dispatcher, bot: Bot) -> web.Application:
+    app = web.Application()
+    app.router.add_get(settings.webhook_health_path, health)
+
+    SimpleRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        secret_token=settings.webhook_secret,
+    ).register(app, path=settings.webhook_path)
+    setup_application(app, dispatcher, bot=bot)
+
+    return app
+
+
+def _install_stop_signals(stop: asyncio.Event) -> None:
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot) -> None:
+    if not settings.webhook_base_url or not settings.webhook_secret:
+        raise RuntimeError("WEBHOOK_BASE_URL and WEBHOOK_SECRET are required in webhook mode")
+
+    await bot.set_webhook(
+        url=settings.webhook_base_url.rstrip("/") + settings.webhook_path,
+        secret_token=settings.webhook_secret,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+
+    runner = web.AppRunner(
+        create_webhook_app(dispatcher, bot),
+        shutdown_timeout=settings.webhook_shutdown_timeout,
+    )
+    await runner.setup()
+    await web.TCPSite(runner, settings.webhook_host, settings.webhook_port).start()
+    logger.info("Вебхук слушает %s:%s%s", settings.webhook_host, settings.webhook_port, settings.webhook_path)
+
+    stop = asyncio.Event()
+    _install_stop_signals(stop)
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()